@@ -1,19 +1,91 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-"""Separate script to run avatar in webview window"""
-import webview
+"""Separate script to run avatar in webview window
+
+Usage:
+    avatar_window.py [x y width height]     standalone window
+    avatar_window.py --control HOST:PORT    hidden window driven by the dashboard
+"""
+import os
 import sys
+import threading
+import webview
+from multiprocessing.connection import Client
 
 AVATAR_URL = "https://stunning-crisp-51ccb2.netlify.app/"
 
+# Set once the dashboard asks us to exit, so closing is no longer vetoed
+quitting = threading.Event()
+
+
+def serve_commands(window, address, authkey):
+    """Apply commands from the dashboard until it quits or disconnects."""
+    try:
+        conn = Client(address, authkey=authkey)
+    except (OSError, EOFError):
+        quitting.set()
+        window.destroy()
+        return
+
+    while True:
+        try:
+            message = conn.recv()
+        except (OSError, EOFError):
+            break   # dashboard is gone; don't linger as an orphan
+        command, args = message[0], message[1:]
+        if command == "show":
+            window.show()
+        elif command == "hide":
+            window.hide()
+        elif command == "move":
+            window.move(*args)
+        elif command == "resize":
+            window.resize(*args)
+        elif command == "reload":
+            window.load_url(AVATAR_URL)
+        elif command == "quit":
+            break
+
+    conn.close()
+    quitting.set()
+    window.destroy()
+
+
 if __name__ == "__main__":
     try:
+        if len(sys.argv) > 2 and sys.argv[1] == "--control":
+            host, port = sys.argv[2].rsplit(":", 1)
+            authkey = bytes.fromhex(os.environ["AVATAR_IPC_KEY"])
+
+            window = webview.create_window(
+                title="Avatar Medico - Asistente Virtual",
+                url=AVATAR_URL,
+                width=600,
+                height=650,
+                background_color="#000000",
+                resizable=True,
+                min_size=(600, 600),
+                hidden=True
+            )
+
+            # Closing the window only hides it, so the next login reuses it
+            def on_closing():
+                if quitting.is_set():
+                    return True
+                window.hide()
+                return False
+            window.events.closing += on_closing
+
+            webview.start(serve_commands, (window, (host, int(port)), authkey),
+                          gui="edgechromium", debug=False)
+            sys.exit(0)
+
         # Get position from command line arguments if provided
         x = int(sys.argv[1]) if len(sys.argv) > 1 else None
         y = int(sys.argv[2]) if len(sys.argv) > 2 else None
         width = int(sys.argv[3]) if len(sys.argv) > 3 else 700
         height = int(sys.argv[4]) if len(sys.argv) > 4 else 800
-        
+
         window_config = {
             "title": "Avatar Medico - Asistente Virtual",
             "url": AVATAR_URL,
@@ -23,11 +95,11 @@ if __name__ == "__main__":
             "resizable": True,
             "min_size": (600, 600)
         }
-        
+
         if x is not None and y is not None:
             window_config["x"] = x
             window_config["y"] = y
-        
+
         webview.create_window(**window_config)
         webview.start(gui="edgechromium", debug=False)
     except Exception as e:
@@ -35,4 +107,3 @@ if __name__ == "__main__":
         import traceback
         traceback.print_exc()
         sys.exit(1)
-
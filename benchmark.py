@@ -0,0 +1,658 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Headless benchmark of the patient dashboard against a local PostgreSQL
+
+Seeds the usuario/paciente/archivo/archivo_asociacion/lookup schema at a
+configurable scale, serves the file URLs from a local HTTP stub and drives
+the real show_login -> show_dashboard -> tab switch -> open_preview flow,
+then prints p50/p99 latencies per step.
+
+Usage:
+    benchmark.py --seed --patients 100000 --max-files 5000
+    benchmark.py --iterations 50 --json results.json
+    benchmark.py --iterations 50 --compare results.json
+    benchmark.py --temp-cluster --seed --patients 10000   throwaway initdb cluster
+
+Without a DISPLAY the run starts its own Xvfb. The target database must have
+"bench" in its name (or pass --force): --seed drops and recreates the tables.
+"""
+import argparse
+import io
+import json
+import math
+import os
+import random
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import psycopg2
+
+STEPS = ("login", "first paint", "tab switch (cold)", "tab switch (warm)",
+         "preview", "preview (reopen)")
+
+
+# ============================================================
+#   SEEDING
+# ============================================================
+SCHEMA_SQL = """
+DROP TABLE IF EXISTS archivo_asociacion, archivo, direccion_paciente, paciente,
+                     medico, usuario, tipo_sangre, ocupacion, estado_civil CASCADE;
+
+CREATE TABLE tipo_sangre (id SERIAL PRIMARY KEY, tipo TEXT NOT NULL);
+CREATE TABLE ocupacion (id SERIAL PRIMARY KEY, nombre TEXT NOT NULL);
+CREATE TABLE estado_civil (id SERIAL PRIMARY KEY, nombre TEXT NOT NULL);
+
+CREATE TABLE usuario (
+    id SERIAL PRIMARY KEY,
+    username TEXT NOT NULL,
+    rol_id INTEGER NOT NULL,
+    password_hash TEXT,
+    correo TEXT,
+    telefono TEXT
+);
+
+CREATE TABLE medico (id SERIAL PRIMARY KEY, usuario_id INTEGER NOT NULL);
+
+CREATE TABLE paciente (
+    id SERIAL PRIMARY KEY,
+    usuario_id INTEGER NOT NULL,
+    fecha_nacimiento DATE,
+    sexo TEXT,
+    altura NUMERIC(5, 1),
+    peso NUMERIC(5, 1),
+    estilo_vida TEXT,
+    id_tipo_sangre INTEGER,
+    id_ocupacion INTEGER,
+    id_estado_civil INTEGER,
+    id_medico_gen INTEGER
+);
+
+CREATE TABLE direccion_paciente (
+    id SERIAL PRIMARY KEY,
+    paciente_id INTEGER NOT NULL,
+    calle TEXT,
+    numero_ext TEXT,
+    numero_int TEXT
+);
+
+CREATE TABLE archivo (id SERIAL PRIMARY KEY, tipo TEXT NOT NULL, url TEXT NOT NULL);
+
+CREATE TABLE archivo_asociacion (
+    id SERIAL PRIMARY KEY,
+    archivo_id INTEGER NOT NULL,
+    entidad TEXT NOT NULL,
+    entidad_id INTEGER NOT NULL,
+    descripcion TEXT
+);
+"""
+
+# Created after COPY so the bulk load doesn't maintain them row by row
+INDEX_SQL = """
+ALTER TABLE usuario ADD CONSTRAINT usuario_username_key UNIQUE (username);
+CREATE INDEX paciente_usuario_idx ON paciente (usuario_id);
+CREATE INDEX paciente_medico_idx ON paciente (id_medico_gen, id);
+CREATE INDEX medico_usuario_idx ON medico (usuario_id);
+CREATE INDEX direccion_paciente_idx ON direccion_paciente (paciente_id);
+CREATE INDEX archivo_asociacion_entidad_idx ON archivo_asociacion (entidad, entidad_id, archivo_id, id);
+"""
+
+BLOOD_TYPES = ("A+", "A-", "B+", "B-", "AB+", "AB-", "O+", "O-")
+OCCUPATIONS = ("Estudiante", "Docente", "Ingeniero", "Comerciante", "Enfermero",
+               "Abogado", "Chofer", "Contador", "Hogar", "Jubilado")
+MARITAL = ("Soltero", "Casado", "Divorciado", "Viudo", "Unión libre")
+LIFESTYLES = ("Sedentario", "Activo", "Muy activo")
+STREETS = ("Av. Juárez", "Calle Hidalgo", "Av. Reforma", "Calle Morelos", "Blvd. Díaz Ordaz")
+DESCRIPTIONS = ("Radiografía de tórax", "Biometría hemática", "Receta médica",
+                "Ultrasonido abdominal", "Electrocardiograma", "Resultados de laboratorio")
+
+
+class IterFile:
+    """Read-only file over an iterator of text lines, fed to COPY ... FROM STDIN."""
+
+    def __init__(self, lines):
+        self._lines = lines
+        self._buf = ""
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buf) < size:
+            try:
+                self._buf += next(self._lines)
+            except StopIteration:
+                break
+        if size < 0:
+            size = len(self._buf)
+        out, self._buf = self._buf[:size], self._buf[size:]
+        return out
+
+
+def copy_rows(cur, table, columns, rows):
+    lines = ("\t".join(r"\N" if v is None else str(v) for v in row) + "\n" for row in rows)
+    cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", IterFile(lines))
+
+
+def file_counts(patients, max_files, dist, rng):
+    """Files per patient. 'pareto' is mostly small with a long tail; patient 1
+    always gets max_files so the worst case is in every data set."""
+    counts = []
+    for _ in range(patients):
+        if dist == "uniform":
+            counts.append(rng.randint(0, max_files))
+        else:
+            counts.append(min(max_files, int(rng.paretovariate(1.16)) - 1))
+    if counts:
+        counts[0] = max_files
+    return counts
+
+
+def seed(conn, args):
+    import bcrypt
+
+    rng = random.Random(args.random_seed)
+    base_url = f"http://127.0.0.1:{args.http_port}/files"
+    # One hash for everybody: bcrypt at production cost per row would take hours
+    password_hash = bcrypt.hashpw(args.password.encode("utf-8"),
+                                  bcrypt.gensalt(rounds=args.bcrypt_rounds)).decode("ascii")
+    counts = file_counts(args.patients, args.max_files, args.files_dist, rng)
+    t0 = time.perf_counter()
+
+    with conn.cursor() as cur:
+        cur.execute(SCHEMA_SQL)
+        copy_rows(cur, "tipo_sangre", ("tipo",), ((t,) for t in BLOOD_TYPES))
+        copy_rows(cur, "ocupacion", ("nombre",), ((o,) for o in OCCUPATIONS))
+        copy_rows(cur, "estado_civil", ("nombre",), ((m,) for m in MARITAL))
+
+        copy_rows(cur, "usuario", ("id", "username", "rol_id", "password_hash", "correo", "telefono"),
+                  ((i, f"paciente{i}", 3, password_hash, f"paciente{i}@example.com",
+                    f"55{i:08d}") for i in range(1, args.patients + 1)))
+        # Physicians are users medico1..medicoN after the patients
+        copy_rows(cur, "usuario", ("id", "username", "rol_id", "password_hash", "correo", "telefono"),
+                  ((args.patients + m, f"medico{m}", 2, password_hash, f"medico{m}@example.com", None)
+                   for m in range(1, args.physicians + 1)))
+        copy_rows(cur, "medico", ("id", "usuario_id"),
+                  ((m, args.patients + m) for m in range(1, args.physicians + 1)))
+
+        def physician(i):
+            # medico1 carries half of all patients: the large-roster case
+            if not args.physicians:
+                return None
+            if args.physicians == 1 or i % 2:
+                return 1
+            return 2 + (i // 2) % (args.physicians - 1)
+
+        born = date(1940, 1, 1)
+        copy_rows(cur, "paciente",
+                  ("id", "usuario_id", "fecha_nacimiento", "sexo", "altura", "peso", "estilo_vida",
+                   "id_tipo_sangre", "id_ocupacion", "id_estado_civil", "id_medico_gen"),
+                  ((i, i, born + timedelta(days=rng.randrange(30000)), rng.choice("MF"),
+                    round(rng.uniform(150, 195), 1), round(rng.uniform(45, 120), 1),
+                    rng.choice(LIFESTYLES), rng.randint(1, len(BLOOD_TYPES)),
+                    rng.randint(1, len(OCCUPATIONS)), rng.randint(1, len(MARITAL)),
+                    physician(i))
+                   for i in range(1, args.patients + 1)))
+
+        # Roughly one patient in ten has no address on file
+        copy_rows(cur, "direccion_paciente", ("paciente_id", "calle", "numero_ext", "numero_int"),
+                  ((i, rng.choice(STREETS), rng.randint(1, 3000), rng.choice((None, None, "A", "2")))
+                   for i in range(1, args.patients + 1) if rng.random() < 0.9))
+
+        def files():
+            file_id = 0
+            for patient_id, n in enumerate(counts, 1):
+                for _ in range(n):
+                    file_id += 1
+                    yield patient_id, file_id
+
+        # Same deterministic walk for both tables, so ids line up
+        copy_rows(cur, "archivo", ("id", "tipo", "url"),
+                  ((fid, "pdf", f"{base_url}/{fid}.pdf") if fid % 4 == 0 else
+                   (fid, "imagen", f"{base_url}/{fid}.jpg") for _, fid in files()))
+        copy_rows(cur, "archivo_asociacion", ("archivo_id", "entidad", "entidad_id", "descripcion"),
+                  ((fid, "paciente", pid, DESCRIPTIONS[fid % len(DESCRIPTIONS)])
+                   for pid, fid in files()))
+
+        for table in ("usuario", "medico", "paciente", "archivo"):
+            cur.execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                        f"GREATEST((SELECT max(id) FROM {table}), 1))")
+        cur.execute(INDEX_SQL)
+    conn.commit()
+
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute("ANALYZE")
+    conn.autocommit = False
+
+    print(f"Seeded {args.patients} patients, {args.physicians} physicians and {sum(counts)} files "
+          f"(max {max(counts, default=0)} per patient) in {time.perf_counter() - t0:.1f}s")
+
+
+# ============================================================
+#   HTTP STUB
+# ============================================================
+IMAGE_VARIANTS = 8
+
+
+class FileServer(ThreadingHTTPServer):
+    """Serves /files/<id>.jpg and /files/<id>.pdf with ETag revalidation.
+
+    Bodies are generated once per variant (id % IMAGE_VARIANTS) and kept in
+    memory, so the stub itself never shows up in the timings.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, port, image_size, latency):
+        super().__init__(("127.0.0.1", port), FileHandler)
+        self.image_size = image_size
+        self.latency = latency
+        self._blobs = {}
+        self._lock = threading.Lock()
+
+    def blob(self, variant, ext):
+        with self._lock:
+            if (variant, ext) not in self._blobs:
+                self._blobs[variant, ext] = make_blob(variant, ext, self.image_size)
+            return self._blobs[variant, ext]
+
+
+def make_blob(variant, ext, size):
+    from PIL import Image
+
+    width, height = size
+    # Noise keeps the JPEG close to a real photo's size
+    noise = Image.effect_noise((width, height), 24 + 4 * variant)
+    gradient = Image.linear_gradient("L").resize((width, height))
+    img = Image.merge("RGB", (gradient, noise, gradient.transpose(Image.Transpose.FLIP_TOP_BOTTOM)))
+    out = io.BytesIO()
+    if ext == "pdf":
+        img.resize((1240, 1754)).save(out, "PDF", resolution=150)
+    else:
+        img.save(out, "JPEG", quality=85)
+    return out.getvalue()
+
+
+class FileHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        m = re.fullmatch(r"/files/(\d+)\.(jpg|pdf)", self.path)
+        if not m:
+            self.send_error(404)
+            return
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        etag = f'"{m[1]}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        body = self.server.blob(int(m[1]) % IMAGE_VARIANTS, m[2])
+        self.send_response(200)
+        self.send_header("Content-Type", "application/pdf" if m[2] == "pdf" else "image/jpeg")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# ============================================================
+#   ENVIRONMENT (Xvfb, throwaway cluster)
+# ============================================================
+def start_xvfb(display):
+    """Start Xvfb on display unless there already is a screen. Returns the process or None."""
+    if os.environ.get("DISPLAY") or sys.platform in ("win32", "darwin"):
+        return None
+    if not shutil.which("Xvfb"):
+        sys.exit("No DISPLAY and Xvfb is not installed.")
+    proc = subprocess.Popen(["Xvfb", display, "-screen", "0", "1920x1080x24", "-nolisten", "tcp"],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    sock = f"/tmp/.X11-unix/X{display.lstrip(':')}"
+    deadline = time.monotonic() + 10
+    while not os.path.exists(sock):
+        if proc.poll() is not None or time.monotonic() > deadline:
+            proc.kill()
+            sys.exit(f"Xvfb did not start on {display}.")
+        time.sleep(0.05)
+    os.environ["DISPLAY"] = display
+    return proc
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class TempCluster:
+    """initdb + pg_ctl cluster in a temp directory, removed on stop()."""
+
+    def __init__(self, pg_bin=None):
+        self.pg_bin = pg_bin
+        self.datadir = tempfile.mkdtemp(prefix="bench-pg-")
+        self.port = free_port()
+
+    def _tool(self, name):
+        path = os.path.join(self.pg_bin, name) if self.pg_bin else shutil.which(name)
+        if not path or not os.path.exists(path):
+            sys.exit(f"{name} not found; pass --pg-bin with PostgreSQL's bin directory.")
+        return path
+
+    def start(self, dbname):
+        subprocess.run([self._tool("initdb"), "-D", self.datadir, "-U", "bench",
+                        "--auth=trust", "-E", "UTF8"], check=True, stdout=subprocess.DEVNULL)
+        options = f"-p {self.port} -k {self.datadir} -c listen_addresses=127.0.0.1 -c fsync=off"
+        subprocess.run([self._tool("pg_ctl"), "-D", self.datadir, "-o", options,
+                        "-l", os.path.join(self.datadir, "server.log"), "-w", "start"],
+                       check=True, stdout=subprocess.DEVNULL)
+        conn = psycopg2.connect(host="127.0.0.1", port=self.port, dbname="postgres", user="bench")
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute(f'CREATE DATABASE "{dbname}"')
+        conn.close()
+        return {"host": "127.0.0.1", "port": self.port, "dbname": dbname,
+                "user": "bench", "password": ""}
+
+    def stop(self):
+        subprocess.run([self._tool("pg_ctl"), "-D", self.datadir, "-m", "fast", "stop"],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        shutil.rmtree(self.datadir, ignore_errors=True)
+
+
+# ============================================================
+#   UI DRIVER
+# ============================================================
+class StepTimeout(Exception):
+    pass
+
+
+class Driver:
+    """Clicks through the real Tk screens and times each step."""
+
+    def __init__(self, app, root, timeout):
+        self.app = app
+        self.root = root
+        self.timeout = timeout
+        self.errors = []
+        # A dialog would block the run; record it and fail the step instead
+        app.messagebox.showerror = lambda title, msg, **kw: self.errors.append(f"{title}: {msg}")
+        app.messagebox.showwarning = app.messagebox.showerror
+
+    def widgets(self, cls, parent=None):
+        stack = [parent or self.root]
+        while stack:
+            w = stack.pop()
+            if isinstance(w, cls):
+                yield w
+            stack.extend(reversed(w.winfo_children()))
+
+    def button(self, text):
+        for b in self.widgets(self.app.tk.Button):
+            if b.cget("text") == text:
+                return b
+        raise LookupError(f"No button '{text}' on screen")
+
+    def pump_until(self, cond, step):
+        """Run the event loop until cond() holds; returns perf_counter() at that point."""
+        deadline = time.perf_counter() + self.timeout
+        while True:
+            self.root.update()
+            if self.errors:
+                raise RuntimeError(f"{step}: {self.errors.pop()}")
+            if cond():
+                return time.perf_counter()
+            if time.perf_counter() > deadline:
+                raise StepTimeout(f"{step} took longer than {self.timeout}s")
+            time.sleep(0.001)
+
+    def rendered(self, since, *names):
+        """True once the tracer holds a finished span in names that started after since."""
+        since_us = (since - self.app.tracer.t0) * 1e6
+        return any(e["name"] in names and e["ts"] >= since_us
+                   for e in reversed(self.app.tracer.events))
+
+    def session(self, username, password, preview_url):
+        """One login -> paciente -> partes -> paciente -> partes -> preview x2 -> logout."""
+        times = {}
+        entries = list(self.widgets(self.app.tk.Entry))
+        for entry, value in zip(entries, (username, password)):
+            entry.delete(0, "end")
+            entry.insert(0, value)
+
+        t0 = time.perf_counter()
+        self.button("Iniciar Sesión").invoke()
+        times["login"] = self.pump_until(self.app.login_successful.is_set, "login") - t0
+        # A snapshot paint counts: it's what the user sees first
+        times["first paint"] = self.pump_until(
+            lambda: self.rendered(t0, "render paciente", "render paciente snapshot"),
+            "first paint") - t0
+
+        t0 = time.perf_counter()
+        self.button("📁 Archivos Médicos").invoke()
+        times["tab switch (cold)"] = self.pump_until(
+            lambda: self.rendered(t0, "render partes", "render partes snapshot"),
+            "tab switch") - t0
+
+        self.button("📋 Información del Paciente").invoke()
+        self.root.update()
+        t0 = time.perf_counter()
+        self.button("📁 Archivos Médicos").invoke()
+        self.root.update_idletasks()
+        times["tab switch (warm)"] = time.perf_counter() - t0
+
+        if preview_url:
+            for step in ("preview", "preview (reopen)"):
+                times[step] = self.preview(preview_url, step)
+
+        self.button("Cerrar Sesión").invoke()
+        self.root.update()
+        return times
+
+    def preview(self, url, step):
+        t0 = time.perf_counter()
+        self.app.open_preview(url, "imagen")
+        window = self.app._preview_window
+
+        def status():
+            # The status line reads "<w>×<h>" once the full image is shown
+            for label in self.widgets(self.app.tk.Label, window):
+                text = label.cget("text")
+                if "×" in text:
+                    return True
+                if text == "No se pudo cargar la imagen.":
+                    self.errors.append(f"preview of {url} failed")
+            return False
+
+        try:
+            return self.pump_until(status, step) - t0
+        finally:
+            window.close()
+
+
+# ============================================================
+#   REPORT
+# ============================================================
+def percentile(values, p):
+    """Nearest-rank percentile."""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def summarize(samples):
+    out = {}
+    for step in STEPS:
+        ms = [t * 1000 for t in samples.get(step, [])]
+        if ms:
+            out[step] = {"n": len(ms), "p50": percentile(ms, 50), "p99": percentile(ms, 99),
+                         "mean": sum(ms) / len(ms), "max": max(ms)}
+    return out
+
+
+def print_report(results, baseline=None):
+    print(f"\n{'step':<20}{'n':>5}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+          + (f"{'p50 Δ':>9}{'p99 Δ':>9}" if baseline else ""))
+    for step, r in results.items():
+        line = f"{step:<20}{r['n']:>5}{r['p50']:>10.1f}{r['p99']:>10.1f}{r['max']:>10.1f}"
+        old = (baseline or {}).get(step)
+        if old:
+            line += "".join(f"{(r[k] - old[k]) / old[k] * 100:>+8.1f}%" if old[k] else f"{'n/a':>9}"
+                            for k in ("p50", "p99"))
+        print(line)
+
+
+# ============================================================
+#   MAIN
+# ============================================================
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    db = parser.add_argument_group("database")
+    db.add_argument("--db-host", default=os.getenv("DB_HOST", "localhost"))
+    db.add_argument("--db-port", type=int, default=int(os.getenv("DB_PORT", "5432")))
+    db.add_argument("--db-name", default=os.getenv("BENCH_DB_NAME", "medico_bench"))
+    db.add_argument("--db-user", default=os.getenv("DB_USER", "admin"))
+    db.add_argument("--db-password", default=os.getenv("DB_PASSWORD", "admin123"))
+    db.add_argument("--temp-cluster", action="store_true",
+                    help="run a throwaway initdb cluster instead of connecting to --db-host")
+    db.add_argument("--pg-bin", help="directory with initdb/pg_ctl for --temp-cluster")
+    db.add_argument("--force", action="store_true",
+                    help="allow --seed on a database without 'bench' in its name")
+
+    data = parser.add_argument_group("data set")
+    data.add_argument("--seed", action="store_true", help="drop, create and fill the tables")
+    data.add_argument("--patients", type=int, default=1000)
+    data.add_argument("--max-files", type=int, default=50)
+    data.add_argument("--physicians", type=int, default=10)
+    data.add_argument("--files-dist", choices=("pareto", "uniform"), default="pareto")
+    data.add_argument("--random-seed", type=int, default=42)
+    data.add_argument("--password", default="bench123")
+    data.add_argument("--bcrypt-rounds", type=int, default=12)
+
+    run = parser.add_argument_group("run")
+    run.add_argument("--iterations", type=int, default=20)
+    run.add_argument("--warmup", type=int, default=2, help="sessions run before measuring")
+    run.add_argument("--http-port", type=int, default=8765)
+    run.add_argument("--http-latency-ms", type=float, default=0)
+    run.add_argument("--image-size", default="2400x1800")
+    run.add_argument("--display", default=":99", help="Xvfb display when there is no DISPLAY")
+    run.add_argument("--step-timeout", type=float, default=60)
+    run.add_argument("--json", help="write the results to this file")
+    run.add_argument("--compare", help="show the change against an earlier --json file")
+    run.add_argument("--trace-out", help="export the Chrome trace of the run")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    cluster = xvfb = server = None
+    try:
+        if args.temp_cluster:
+            cluster = TempCluster(args.pg_bin)
+            db_config = cluster.start(args.db_name)
+        else:
+            db_config = {"host": args.db_host, "port": args.db_port, "dbname": args.db_name,
+                         "user": args.db_user, "password": args.db_password}
+
+        if args.seed:
+            if "bench" not in db_config["dbname"] and not args.force:
+                sys.exit(f"Refusing to drop tables in '{db_config['dbname']}'; use --force.")
+            conn = psycopg2.connect(**db_config)
+            try:
+                seed(conn, args)
+            finally:
+                conn.close()
+        if not args.iterations:
+            return
+
+        width, height = (int(v) for v in args.image_size.lower().split("x"))
+        server = FileServer(args.http_port, (width, height), args.http_latency_ms / 1000)
+        threading.Thread(target=server.serve_forever, name="http-stub", daemon=True).start()
+        xvfb = start_xvfb(args.display)
+
+        # The app reads its configuration at import time
+        os.environ.update({
+            "DB_HOST": db_config["host"], "DB_PORT": str(db_config["port"]),
+            "DB_NAME": db_config["dbname"], "DB_USER": db_config["user"],
+            "DB_PASSWORD": db_config["password"],
+            "AVATAR": "0", "TRACE": "1", "TRACE_MAX_EVENTS": "200000",
+            "FILE_CACHE_DIR": tempfile.mkdtemp(prefix="bench-cache-"),
+        })
+        import patient_dashboard as app
+
+        samples = run_sessions(app, args)
+    finally:
+        if server is not None:
+            server.shutdown()
+        if xvfb is not None:
+            xvfb.terminate()
+        if cluster is not None:
+            cluster.stop()
+
+    results = summarize(samples)
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+    print_report(results, baseline)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"params": vars(args), "results": results}, f, indent=2)
+    if args.trace_out:
+        app.tracer.export_chrome(args.trace_out)
+
+
+def run_sessions(app, args):
+    rng = random.Random(args.random_seed)
+    root = app.tk.Tk()
+    root.geometry("1500x900")
+    driver = Driver(app, root, args.step_timeout)
+    app.show_login(root)
+    root.update()
+
+    with app.db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT max(id) FROM paciente")
+        patients = cur.fetchone()[0] or 0
+    if not patients:
+        sys.exit("No patients in the database; run with --seed first.")
+
+    # Patient 1 holds the largest file list and is the first measured
+    # session (after the warmup ones); the rest are random
+    total = args.warmup + args.iterations
+    others = range(2, patients + 1)
+    picked = (rng.sample(others, total - 1) if len(others) >= total - 1
+              else rng.choices(others or [1], k=total - 1))
+    ids = picked[:args.warmup] + [1] + picked[args.warmup:]
+
+    samples = {}
+    try:
+        for n, patient_id in enumerate(ids):
+            files, _ = app.get_files_page(patient_id)
+            preview_url = next((url for _, tipo, url in files if app.is_image(tipo)), None)
+            times = driver.session(f"paciente{patient_id}", args.password, preview_url)
+            if n < args.warmup:
+                continue
+            for step, t in times.items():
+                samples.setdefault(step, []).append(t)
+            print(f"[{n - args.warmup + 1}/{args.iterations}] paciente{patient_id}: "
+                  + ", ".join(f"{k} {v * 1000:.0f} ms" for k, v in times.items()))
+    finally:
+        root.destroy()
+        app.close_pool()
+    return samples
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+-- Change notifications for the patient dashboard.
+--
+-- Every insert, update or delete on a table the dashboard shows sends
+--   NOTIFY paciente_cambio, '{"paciente_id": <id>, "tabla": "<table>"}'
+-- so an open dashboard refreshes that patient's views without polling.
+-- Notifications are delivered on commit; safe to run more than once.
+
+CREATE OR REPLACE FUNCTION notify_paciente_cambio() RETURNS trigger AS $$
+DECLARE
+    r RECORD;
+    pid INTEGER;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        r := OLD;
+    ELSE
+        r := NEW;
+    END IF;
+
+    IF TG_TABLE_NAME = 'paciente' THEN
+        pid := r.id;
+    ELSIF TG_TABLE_NAME = 'direccion_paciente' THEN
+        pid := r.paciente_id;
+    ELSIF TG_TABLE_NAME = 'archivo_asociacion' THEN
+        IF r.entidad <> 'paciente' THEN
+            RETURN NULL;
+        END IF;
+        pid := r.entidad_id;
+    ELSIF TG_TABLE_NAME = 'usuario' THEN
+        SELECT p.id INTO pid FROM paciente p WHERE p.usuario_id = r.id LIMIT 1;
+    END IF;
+
+    IF pid IS NOT NULL THEN
+        PERFORM pg_notify('paciente_cambio',
+                          json_build_object('paciente_id', pid, 'tabla', TG_TABLE_NAME)::text);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS paciente_cambio ON paciente;
+CREATE TRIGGER paciente_cambio AFTER INSERT OR UPDATE OR DELETE ON paciente
+    FOR EACH ROW EXECUTE FUNCTION notify_paciente_cambio();
+
+DROP TRIGGER IF EXISTS paciente_cambio ON usuario;
+CREATE TRIGGER paciente_cambio AFTER UPDATE OR DELETE ON usuario
+    FOR EACH ROW EXECUTE FUNCTION notify_paciente_cambio();
+
+DROP TRIGGER IF EXISTS paciente_cambio ON direccion_paciente;
+CREATE TRIGGER paciente_cambio AFTER INSERT OR UPDATE OR DELETE ON direccion_paciente
+    FOR EACH ROW EXECUTE FUNCTION notify_paciente_cambio();
+
+DROP TRIGGER IF EXISTS paciente_cambio ON archivo_asociacion;
+CREATE TRIGGER paciente_cambio AFTER INSERT OR UPDATE OR DELETE ON archivo_asociacion
+    FOR EACH ROW EXECUTE FUNCTION notify_paciente_cambio();
@@ -1,302 +1,3346 @@
+import time
+STARTUP_T0 = time.perf_counter()
+
 import tkinter as tk
-from tkinter import ttk, messagebox
+from tkinter import ttk, messagebox, filedialog
 import threading
-import psycopg2
-import webview
-from PIL import Image, ImageTk
-import requests
+import queue
+import sys
+import importlib
+import importlib.util
+import functools
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
 from io import BytesIO
+import heapq
+import itertools
+from collections import OrderedDict, Counter, deque
 import webbrowser
+import subprocess
+from multiprocessing.connection import Listener
 import os
+import json
+import tempfile
+import shutil
+import math
+import select
 from dotenv import load_dotenv
 import hashlib
-import bcrypt
-try:
-    from tkinterweb import HtmlFrame
-    TKINTERWEB_AVAILABLE = True
-except ImportError:
-    TKINTERWEB_AVAILABLE = False
-
-try:
-    from cefpython3 import cefpython as cef
-    import platform
-    CEF_AVAILABLE = True
-except ImportError:
-    CEF_AVAILABLE = False
+import csv
+import zipfile
+from urllib.parse import urlparse
+
+
+# ============================================================
+#   STARTUP TIMING + LAZY IMPORTS
+# ============================================================
+class StartupTimer:
+    """Built-in startup profile: milestones since launch and deferred imports.
+
+    Printed once the login screen is interactive when the app runs with
+    --startup-report or STARTUP_REPORT=1.
+    """
+
+    def __init__(self, t0):
+        self.t0 = t0
+        self.marks = []      # [(label, perf_counter)]
+        self.imports = []    # [(module, seconds, thread name, ms since launch)]
+        self._lock = threading.Lock()
+
+    def mark(self, label):
+        self.marks.append((label, time.perf_counter()))
+
+    def record_import(self, name, seconds):
+        with self._lock:
+            self.imports.append((name, seconds, threading.current_thread().name,
+                                 (time.perf_counter() - self.t0) * 1000))
+
+    def report(self):
+        lines = ["Startup timing (ms since launch, +delta)"]
+        prev = self.t0
+        for label, t in self.marks:
+            lines.append(f"  {(t - self.t0) * 1000:8.1f}  +{(t - prev) * 1000:7.1f}  {label}")
+            prev = t
+        with self._lock:
+            imports = list(self.imports)
+        if imports:
+            lines.append("Deferred imports (ms to import, when, thread)")
+            for name, seconds, thread, at in imports:
+                lines.append(f"  {seconds * 1000:8.1f}  {name:<16} at {at:.0f}  {thread}")
+        return "\n".join(lines)
+
+
+startup = StartupTimer(STARTUP_T0)
+STARTUP_REPORT = os.getenv("STARTUP_REPORT") == "1" or "--startup-report" in sys.argv
+
+
+class LazyModule:
+    """Module proxy that imports the real module on first attribute access.
+
+    Keeps psycopg2, PIL, requests, bcrypt and PyMuPDF off the path to the
+    login screen; each load is recorded in the startup report.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    t = time.perf_counter()
+                    module = importlib.import_module(self._name)
+                    startup.record_import(self._name, time.perf_counter() - t)
+                    self._module = module
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+
+psycopg2 = LazyModule("psycopg2")
+requests = LazyModule("requests")
+bcrypt = LazyModule("bcrypt")
+Image = LazyModule("PIL.Image")
+ImageFile = LazyModule("PIL.ImageFile")
+ImageTk = LazyModule("PIL.ImageTk")
+pymupdf = LazyModule("pymupdf")
+PYMUPDF_AVAILABLE = importlib.util.find_spec("pymupdf") is not None
+sqlite3 = LazyModule("sqlite3")
+fernet = LazyModule("cryptography.fernet")
+CRYPTOGRAPHY_AVAILABLE = importlib.util.find_spec("cryptography") is not None
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Global flag to track login status
+login_successful = threading.Event()
+
+# Avatar URL
+AVATAR_URL = "https://stunning-crisp-51ccb2.netlify.app/"
+
+# ============================================================
+#   TRACING
+# ============================================================
+TRACE_ENABLED = os.getenv("TRACE") == "1" or "--trace" in sys.argv
+TRACE_MAX_EVENTS = int(os.getenv("TRACE_MAX_EVENTS", "5000"))
+
+
+class Tracer:
+    """Ring buffer of timed events for SQL statements, HTTP fetches and UI renders.
+
+    span() times a block and records its args (rows, bytes, status...).
+    Events export as JSON lines or in Chrome trace format for
+    chrome://tracing / Perfetto. Disabled spans cost one attribute check.
+    """
+
+    def __init__(self, enabled=False, max_events=5000):
+        self.enabled = enabled
+        self.events = deque(maxlen=max_events)
+        self.t0 = time.perf_counter()
+        self.pid = os.getpid()
+
+    @contextmanager
+    def span(self, cat, name, **args):
+        if not self.enabled:
+            yield args
+            return
+        start = time.perf_counter()
+        try:
+            yield args
+        except BaseException as e:
+            args["error"] = type(e).__name__
+            raise
+        finally:
+            self._record(cat, name, start, time.perf_counter() - start, args)
+
+    def instant(self, cat, name, **args):
+        if self.enabled:
+            self._record(cat, name, time.perf_counter(), 0.0, args)
+
+    def _record(self, cat, name, start, duration, args):
+        # deque.append is atomic, so worker threads need no lock here
+        self.events.append({
+            "cat": cat,
+            "name": name,
+            "ts": round((start - self.t0) * 1e6),
+            "dur": round(duration * 1e6),
+            "thread": threading.current_thread().name,
+            "args": args,
+        })
+
+    def clear(self):
+        self.events.clear()
+
+    def summary(self):
+        """{(cat, name): (count, total ms, max ms)} over the buffered events."""
+        out = {}
+        for e in list(self.events):
+            count, total, worst = out.get((e["cat"], e["name"]), (0, 0.0, 0.0))
+            ms = e["dur"] / 1000
+            out[(e["cat"], e["name"])] = (count + 1, total + ms, max(worst, ms))
+        return out
+
+    def export_jsonl(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            for e in list(self.events):
+                f.write(json.dumps(e, default=str) + "\n")
+
+    def export_chrome(self, path):
+        threads = {}
+        trace = []
+        for e in list(self.events):
+            tid = threads.setdefault(e["thread"], len(threads) + 1)
+            trace.append({"name": e["name"], "cat": e["cat"], "ph": "X" if e["dur"] else "i",
+                          "ts": e["ts"], "dur": e["dur"], "pid": self.pid, "tid": tid,
+                          "args": e["args"]})
+        for name, tid in threads.items():
+            trace.append({"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid,
+                          "args": {"name": name}})
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": trace}, f, default=str)
+
+
+tracer = Tracer(TRACE_ENABLED, TRACE_MAX_EVENTS)
+
+
+def traced(cat, name=None):
+    """Decorator: record every call of the function as a span."""
+    def decorate(fn):
+        label = name or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return fn(*args, **kwargs)
+            with tracer.span(cat, label):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def _sql_summary(query):
+    if isinstance(query, bytes):
+        query = query.decode("utf-8", "replace")
+    return " ".join(str(query).split())[:200]
+
+
+@functools.lru_cache(maxsize=None)
+def tracing_cursor_class():
+    # Built on first connect so psycopg2 stays a lazy import
+    class TracingCursor(psycopg2.extensions.cursor):
+        """Cursor that records each statement with its duration and row count."""
+
+        def execute(self, query, vars=None):
+            if not tracer.enabled:
+                return super().execute(query, vars)
+            with tracer.span("sql", "execute", sql=_sql_summary(query)) as args:
+                result = super().execute(query, vars)
+                args["rows"] = self.rowcount
+                return result
+
+    return TracingCursor
+
+
+def open_trace_overlay(root):
+    """Debug window (F12) with per-operation totals, recent events and export."""
+    existing = getattr(root, "trace_overlay", None)
+    if existing is not None and existing.winfo_exists():
+        existing.lift()
+        return
+
+    win = root.trace_overlay = tk.Toplevel(root)
+    win.title("Trazas de rendimiento")
+    win.geometry("900x600")
+    win.configure(bg=BG1)
+
+    bar = tk.Frame(win, bg=BG1)
+    bar.pack(fill="x", padx=10, pady=8)
+    enabled = tk.BooleanVar(value=tracer.enabled)
+
+    def toggle():
+        tracer.enabled = enabled.get()
+
+    tk.Checkbutton(bar, text="Grabar", variable=enabled, command=toggle, bg=BG1, fg=TEXT,
+                   selectcolor=BG2, activebackground=BG1).pack(side="left")
+
+    def export(chrome):
+        ext = ".json" if chrome else ".jsonl"
+        path = filedialog.asksaveasfilename(parent=win, defaultextension=ext,
+                                            initialfile=f"trace{ext}")
+        if path:
+            (tracer.export_chrome if chrome else tracer.export_jsonl)(path)
+
+    for text, command in (("Exportar JSONL", lambda: export(False)),
+                          ("Exportar Chrome trace", lambda: export(True)),
+                          ("Limpiar", tracer.clear)):
+        tk.Button(bar, text=text, command=command, bg=BG2, fg=TEXT, relief="flat",
+                  padx=12, pady=4).pack(side="right", padx=4)
+
+    body = tk.Text(win, bg=BG2, fg=TEXT, font=("Consolas", 10), relief="flat", wrap="none")
+    body.pack(fill="both", expand=True, padx=10, pady=(0, 10))
+
+    def refresh():
+        if not win.winfo_exists():
+            return
+        lines = [f"{'categoría':<6} {'operación':<28} {'n':>5} {'total ms':>10} {'máx ms':>9}"]
+        for (cat, name), (count, total, worst) in sorted(
+                tracer.summary().items(), key=lambda item: -item[1][1]):
+            lines.append(f"{cat:<6} {name:<28} {count:>5} {total:>10.1f} {worst:>9.1f}")
+        scheduler = getattr(root, "render_scheduler", None)
+        if scheduler is not None:
+            lines.append("")
+            lines.append(f"render scheduler: {scheduler.stats()}")
+        lines.append("")
+        lines.append(queries.report())
+        if _http is not None:
+            lines.append(f"http: {_http.stats()}")
+        lines.append(f"previews in memory: {decoded_images.stats()}")
+        lines.append("")
+        lines.append("Últimos eventos")
+        for e in list(tracer.events)[-40:][::-1]:
+            args = " ".join(f"{k}={v}" for k, v in e["args"].items())
+            lines.append(f"{e['ts'] / 1000:10.1f}  {e['dur'] / 1000:8.1f} ms  {e['cat']:<5} "
+                         f"{e['name']:<20} {e['thread']:<12} {args}")
+        body.configure(state="normal")
+        body.delete("1.0", "end")
+        body.insert("end", "\n".join(lines))
+        body.configure(state="disabled")
+        win.after(1000, refresh)
+
+    refresh()
+
+
+# ============================================================
+#   STALL DETECTOR
+# ============================================================
+STALL_DETECT = os.getenv("STALL_DETECT") == "1" or "--stall-detect" in sys.argv
+STALL_THRESHOLD_MS = float(os.getenv("STALL_THRESHOLD_MS", "100"))
+# A stall still going on is reported every this many seconds
+STALL_REPORT_EVERY = float(os.getenv("STALL_REPORT_EVERY", "5"))
+
+
+class StallDetector:
+    """Watchdog for the Tk event loop with a sampling profiler.
+
+    The mainloop bumps a heartbeat every HEARTBEAT_MS. A helper thread
+    checks it every SAMPLE_MS; while the heartbeat is older than the
+    threshold it samples the main thread's stack with sys._current_frames().
+    When the loop recovers, the aggregated blocking frames are logged and
+    recorded in the tracer; a stall that doesn't recover is reported every
+    report_every seconds so a real hang still leaves a profile behind.
+    """
+
+    HEARTBEAT_MS = 20
+    SAMPLE_MS = 5
+    TOP_STACKS = 3
+    STACK_DEPTH = 8
+
+    def __init__(self, root, threshold_ms=100.0, report_every=5.0):
+        self.root = root
+        self.threshold = threshold_ms / 1000
+        self.report_every = report_every
+        self.main_ident = threading.main_thread().ident
+        self.stalls = []   # [(duration s, samples)]
+        self._last_beat = time.monotonic()
+        self._running = False
+
+    def start(self):
+        self._running = True
+        self._beat()
+        threading.Thread(target=self._watch, name="stall-detector", daemon=True).start()
+
+    def stop(self):
+        self._running = False
+
+    def _beat(self):
+        self._last_beat = time.monotonic()
+        if self._running:
+            self.root.after(self.HEARTBEAT_MS, self._beat)
+
+    def _sample(self):
+        frame = sys._current_frames().get(self.main_ident)
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append((os.path.basename(code.co_filename), frame.f_lineno, code.co_name))
+            frame = frame.f_back
+        return tuple(stack)   # innermost first
+
+    def _watch(self):
+        samples = Counter()
+        stall_start = None
+        while self._running:
+            time.sleep(self.SAMPLE_MS / 1000)
+            beat = self._last_beat
+            lag = time.monotonic() - beat
+            if lag > self.threshold:
+                if stall_start is None:
+                    stall_start = next_report = beat
+                samples[self._sample()] += 1
+                next_report_at = next_report + self.report_every
+                if time.monotonic() >= next_report_at:
+                    # Still blocked: report what has been sampled so far
+                    self._report(time.monotonic() - stall_start, samples, ongoing=True)
+                    next_report = next_report_at
+            elif stall_start is not None:
+                self._report(beat - stall_start, samples)
+                samples = Counter()
+                stall_start = None
+
+    def _report(self, duration, samples, ongoing=False):
+        total = sum(samples.values())
+        if not ongoing:
+            self.stalls.append((duration, total))
+        leaf = Counter()
+        for stack, count in samples.items():
+            if stack:
+                leaf[stack[0]] += count
+
+        state = "en curso, " if ongoing else ""
+        lines = [f"Stall de {duration * 1000:.0f} ms en el mainloop ({state}{total} muestras)"]
+        lines.append("  Frames más frecuentes:")
+        for (filename, lineno, func), count in leaf.most_common(5):
+            lines.append(f"    {count * 100 // total:3d}%  {func} ({filename}:{lineno})")
+        lines.append("  Pilas más frecuentes (la más interna primero):")
+        for stack, count in samples.most_common(self.TOP_STACKS):
+            lines.append(f"    {count * 100 // total:3d}%")
+            for filename, lineno, func in stack[:self.STACK_DEPTH]:
+                lines.append(f"          {func} ({filename}:{lineno})")
+        print("\n".join(lines))
+
+        top = leaf.most_common(1)[0][0] if leaf else None
+        tracer.instant("ui", "stall (ongoing)" if ongoing else "stall",
+                       ms=round(duration * 1000), samples=total,
+                       top=f"{top[2]} ({top[0]}:{top[1]})" if top else None)
+
+
+# ============================================================
+#   CONFIG DB - Docker PostgreSQL
+# ============================================================
+DB_CONFIG = {
+    "host": os.getenv("DB_HOST", os.getenv("POSTGRES_HOST", "localhost")),
+    "port": int(os.getenv("DB_PORT", os.getenv("POSTGRES_PORT", "5432"))),
+    "dbname": os.getenv("DB_NAME", os.getenv("POSTGRES_DB", "medico_db")),
+    "user": os.getenv("DB_USER", os.getenv("POSTGRES_USER", "admin")),
+    "password": os.getenv("DB_PASSWORD", os.getenv("POSTGRES_PASSWORD", "admin123"))
+}
+
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "5"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+# Idle connections older than this are pinged with SELECT 1 before reuse
+DB_POOL_PING_AFTER = float(os.getenv("DB_POOL_PING_AFTER", "30"))
+
+
+class PoolTimeout(Exception):
+    """Raised when no pooled connection frees up within the timeout."""
+
+
+class ConnectionPool:
+    """Thread-safe pool of psycopg2 connections built around DB_CONFIG.
+
+    Connections are checked for liveness when borrowed and replaced when
+    broken. Use ``with pool.connection() as conn:`` so they always go back.
+    """
+
+    def __init__(self, config, minconn=1, maxconn=5, timeout=10.0, ping_after=30.0):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError("Tamaño de pool inválido")
+        self.config = dict(config)
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.ping_after = ping_after
+        self._idle = []      # [(conn, released_at)] - most recently used last
+        self._size = 0       # open connections, idle + borrowed
+        self._closed = False
+        self._cond = threading.Condition()
+        for _ in range(minconn):
+            self._idle.append((self._connect(), time.monotonic()))
+            self._size += 1
+
+    def _connect(self):
+        return psycopg2.connect(connection_factory=pooled_connection_class(),
+                                cursor_factory=tracing_cursor_class(), **self.config)
+
+    def _is_alive(self, conn, released_at):
+        if conn.closed:
+            return False
+        if conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+        if time.monotonic() - released_at < self.ping_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def acquire(self, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise psycopg2.InterfaceError("El pool de conexiones está cerrado")
+                if self._idle:
+                    conn, released_at = self._idle.pop()
+                    break
+                if self._size < self.maxconn:
+                    self._size += 1
+                    conn = released_at = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeout(f"No hay conexiones libres tras {timeout:g}s")
+                self._cond.wait(remaining)
+
+        # Connect / ping outside the lock so other threads aren't blocked
+        try:
+            if conn is not None and self._is_alive(conn, released_at):
+                return conn
+            if conn is not None:
+                self._close_quietly(conn)
+            return self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, conn, discard=False):
+        if not discard and not conn.closed:
+            try:
+                # Never hand out a connection with an open transaction
+                conn.rollback()
+            except psycopg2.Error:
+                discard = True
+        with self._cond:
+            if discard or conn.closed or self._closed:
+                self._close_quietly(conn)
+                self._size -= 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        conn = self.acquire(timeout)
+        try:
+            yield conn
+        except BaseException:
+            self.release(conn, discard=conn.closed != 0)
+            raise
+        else:
+            self.release(conn)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn, _ in idle:
+            self._close_quietly(conn)
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(DB_CONFIG, DB_POOL_MIN, DB_POOL_MAX,
+                                   DB_POOL_TIMEOUT, DB_POOL_PING_AFTER)
+        return _pool
+
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+
+@contextmanager
+def db_connection():
+    """Borrow a pooled connection; it is returned even if the block raises."""
+    with get_pool().connection() as conn:
+        yield conn
+
+
+# ============================================================
+#   PREPARED STATEMENTS
+# ============================================================
+# DB_PREPARE=0 sends plain statements instead (needed behind poolers that
+# don't keep server sessions, e.g. pgbouncer in transaction mode)
+DB_PREPARE = os.getenv("DB_PREPARE", "1") != "0"
+QUERY_STATS = os.getenv("QUERY_STATS") == "1"
+
+
+@functools.lru_cache(maxsize=None)
+def pooled_connection_class():
+    class PooledConnection(psycopg2.extensions.connection):
+        """Connection that remembers which statements it has PREPAREd."""
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.prepared = set()
+
+    return PooledConnection
+
+
+class QueryRegistry:
+    """Named hot statements, prepared once per pooled connection.
+
+    The first execute() of a name on a connection sends PREPARE; every call
+    after that is EXECUTE name(...), so PostgreSQL skips parse and plan.
+    Connections from outside the pool, or DB_PREPARE=0, get plain
+    statements. Per-name counts and timings are kept either way, so a run
+    with DB_PREPARE=0 gives the baseline to compare against.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._sql = {}       # name -> (sql with %s, sql with $n, param count)
+        self._stats = {}     # name -> [executions, total s, prepares, prepare s]
+        self._lock = threading.Lock()
+
+    def register(self, name, sql):
+        if name in self._sql:
+            return
+        parts = sql.split("%s")
+        numbered = parts[0] + "".join(f"${i}{part}" for i, part in enumerate(parts[1:], 1))
+        self._sql[name] = (sql, numbered, len(parts) - 1)
+        self._stats.setdefault(name, [0, 0.0, 0, 0.0])
+
+    def execute(self, cur, name, params=()):
+        sql, numbered, nparams = self._sql[name]
+        prepared = getattr(cur.connection, "prepared", None)
+        if not self.enabled or prepared is None:
+            t = time.perf_counter()
+            cur.execute(sql, params)
+            self._record(name, time.perf_counter() - t)
+            return
+
+        if name not in prepared:
+            self._prepare(cur, name, numbered)
+        statement = f"EXECUTE {name}" + (f" ({', '.join(['%s'] * nparams)})" if nparams else "")
+        t = time.perf_counter()
+        try:
+            cur.execute(statement, params)
+        except psycopg2.Error as e:
+            if e.pgcode != "26000":      # invalid_sql_statement_name
+                raise
+            # The session lost it (DISCARD ALL, server restart): prepare again
+            cur.connection.rollback()
+            self._prepare(cur, name, numbered)
+            t = time.perf_counter()
+            cur.execute(statement, params)
+        self._record(name, time.perf_counter() - t)
+
+    def _prepare(self, cur, name, numbered):
+        t = time.perf_counter()
+        cur.execute(f"PREPARE {name} AS {numbered}")
+        cur.connection.prepared.add(name)
+        with self._lock:
+            stat = self._stats[name]
+            stat[2] += 1
+            stat[3] += time.perf_counter() - t
+
+    def _record(self, name, seconds):
+        with self._lock:
+            stat = self._stats[name]
+            stat[0] += 1
+            stat[1] += seconds
+
+    def stats(self):
+        """{name: (executions, avg ms, prepares, avg prepare ms)}"""
+        with self._lock:
+            return {name: (n, total * 1000 / n if n else 0.0, p, ptotal * 1000 / p if p else 0.0)
+                    for name, (n, total, p, ptotal) in self._stats.items()}
+
+    def report(self):
+        mode = "prepared" if self.enabled else "plain"
+        lines = [f"Statements ({mode}): executions, avg ms, prepares, avg prepare ms"]
+        for name, (n, avg, p, pavg) in sorted(self.stats().items()):
+            lines.append(f"  {name:<22} {n:>6} {avg:>8.2f} {p:>5} {pavg:>8.2f}")
+        return "\n".join(lines)
+
+
+queries = QueryRegistry(DB_PREPARE)
+
+
+def db_error_message(e):
+    if isinstance(e, psycopg2.OperationalError):
+        return (f"Error de conexión a la base de datos:\n{str(e)}\n\nVerifica que:\n"
+                f"- Docker esté corriendo\n- PostgreSQL esté accesible en {DB_CONFIG['host']}:{DB_CONFIG['port']}\n"
+                f"- Las credenciales en .env sean correctas")
+    if isinstance(e, PoolTimeout):
+        return f"La base de datos está ocupada, intenta de nuevo.\n{str(e)}"
+    return f"Error inesperado: {str(e)}"
+
+
+# ============================================================
+#   COLORS
+# ============================================================
+BG1 = "#0b1220"
+BG2 = "#0a1730"
+CARD = "#1a2333"
+TEXT = "#e6f0ff"
+MUTED = "#9bb3d1"
+PRIMARY = "#52e5ff"
+DANGER = "#ff5c7c"
+
+
+# ============================================================
+#   RENDER SCHEDULER
+# ============================================================
+RENDER_STATS = os.getenv("RENDER_STATS") == "1"
+
+
+class RenderScheduler:
+    """Coalesces layout, scroll-region and redraw requests into one idle pass.
+
+    request(fn) marks fn as needed; asking again before the pass runs is
+    free. Everything pending runs once from a single after_idle, so a burst
+    of <Configure> events costs one bbox()/refresh instead of one each.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self._pending = OrderedDict()
+        self._after_id = None
+        self.requests = 0
+        self.runs = 0
+        self.passes = 0
+
+    def request(self, fn, key=None):
+        self.requests += 1
+        self._pending[fn if key is None else key] = fn
+        if self._after_id is None:
+            self._after_id = self.root.after_idle(self._flush)
+
+    def _flush(self):
+        self._after_id = None
+        pending, self._pending = self._pending, OrderedDict()
+        self.passes += 1
+        for fn in pending.values():
+            self.runs += 1
+            try:
+                fn()
+            except tk.TclError:
+                pass   # widget destroyed while the request was pending
+
+    @property
+    def coalesced(self):
+        return self.requests - self.runs - len(self._pending)
+
+    def stats(self):
+        return {"requests": self.requests, "runs": self.runs,
+                "passes": self.passes, "coalesced": self.coalesced}
+
+
+def get_scheduler(widget):
+    """The RenderScheduler shared by every widget under widget's root."""
+    root = widget.nametowidget(".")
+    scheduler = getattr(root, "render_scheduler", None)
+    if scheduler is None:
+        scheduler = root.render_scheduler = RenderScheduler(root)
+    return scheduler
+
+
+# ============================================================
+#   HTTP CLIENT
+# ============================================================
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "30"))
+HTTP_MAX_CONCURRENCY = int(os.getenv("HTTP_MAX_CONCURRENCY", "6"))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "3"))
+
+
+class RequestCancelled(Exception):
+    """The caller's cancelled() turned true while a download waited or streamed."""
+
+
+class Download:
+    """A streaming response being read; counts the bytes that go through."""
+
+    def __init__(self, response, cancelled):
+        self.response = response
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.bytes = 0
+        self._cancelled = cancelled
+
+    def raise_for_status(self):
+        self.response.raise_for_status()
+
+    def iter_content(self, chunk_size):
+        for chunk in self.response.iter_content(chunk_size):
+            if self._cancelled():
+                raise RequestCancelled()
+            self.bytes += len(chunk)
+            yield chunk
+
+
+class HttpClient:
+    """One keep-alive session for every file download in the app.
+
+    requests keeps a connection pool per host, so repeated previews skip
+    the TCP/TLS handshake. Each request gets connect/read timeouts, waits
+    for one of max_concurrent slots, and is retried with exponential
+    backoff on connection errors, timeouts and 429/502/503/504 before the
+    body starts. cancelled() is checked while queued, between retries and
+    between chunks.
+    """
+
+    RETRY_STATUS = (429, 502, 503, 504)
+    BACKOFF = 0.5
+
+    def __init__(self, max_concurrent=6, retries=3, timeout=(5.0, 30.0)):
+        self.timeout = timeout
+        self.retries = retries
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=16, pool_maxsize=max_concurrent)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        self._lock = threading.Lock()
+        self._stats = Counter()
+
+    @contextmanager
+    def get(self, url, headers=None, cancelled=lambda: False):
+        """Stream url; yields a Download and frees the slot on exit."""
+        with tracer.span("http", "GET", url=url, conditional=bool(headers)) as trace:
+            start = time.perf_counter()
+            while not self._slots.acquire(timeout=0.1):
+                if cancelled():
+                    raise RequestCancelled()
+            trace["queued_ms"] = round((time.perf_counter() - start) * 1000, 1)
+            download = None
+            try:
+                response = self._send(url, headers, cancelled, trace)
+                with response:
+                    download = Download(response, cancelled)
+                    trace["status"] = response.status_code
+                    yield download
+            finally:
+                self._slots.release()
+                elapsed = time.perf_counter() - start
+                with self._lock:
+                    self._stats["requests"] += 1
+                    self._stats["bytes"] += download.bytes if download else 0
+                    self._stats["ms"] += elapsed * 1000
+                    self._stats["retries"] += trace.get("retries", 0)
+                if download is not None:
+                    trace["bytes"] = download.bytes
+
+    def _send(self, url, headers, cancelled, trace):
+        for attempt in range(self.retries + 1):
+            if cancelled():
+                raise RequestCancelled()
+            try:
+                response = self._session.get(url, headers=headers, stream=True,
+                                             timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.retries:
+                    raise
+                delay = self.BACKOFF * 2 ** attempt
+            else:
+                if response.status_code not in self.RETRY_STATUS or attempt == self.retries:
+                    return response
+                response.close()
+                retry_after = response.headers.get("Retry-After", "")
+                delay = min(float(retry_after), 10.0) if retry_after.isdigit() else self.BACKOFF * 2 ** attempt
+            trace["retries"] = attempt + 1
+            deadline = time.monotonic() + delay
+            while time.monotonic() < deadline:
+                if cancelled():
+                    raise RequestCancelled()
+                time.sleep(min(0.1, delay))
+
+    def stats(self):
+        """Totals since start: requests, bytes, ms and retries."""
+        with self._lock:
+            return {k: round(v, 1) for k, v in self._stats.items()}
+
+    def close(self):
+        self._session.close()
+
+
+_http = None
+_http_lock = threading.Lock()
+
+
+def get_http():
+    global _http
+    with _http_lock:
+        if _http is None:
+            _http = HttpClient(HTTP_MAX_CONCURRENCY, HTTP_RETRIES,
+                               (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+        return _http
+
+
+# ============================================================
+#   FILE CACHE
+# ============================================================
+def _default_cache_dir():
+    base = os.getenv("LOCALAPPDATA") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "patient_dashboard", "files")
+
+
+FILE_CACHE_DIR = os.getenv("FILE_CACHE_DIR", _default_cache_dir())
+FILE_CACHE_MAX_MB = float(os.getenv("FILE_CACHE_MAX_MB", "500"))
+# Seconds an entry is served straight from disk before it is revalidated,
+# unless the server sent its own Cache-Control max-age
+FILE_CACHE_FRESH = float(os.getenv("FILE_CACHE_FRESH", "3600"))
+
+
+class FileCache:
+    """On-disk cache of downloaded files, keyed by URL and content hash.
+
+    Bodies are stored once under their SHA-256 in ``blobs/``; ``index.json``
+    maps each URL to its blob plus the ETag/Last-Modified validators. Fresh
+    entries are served without touching the network, stale ones are
+    revalidated with a conditional GET (a 304 reuses the blob). The least
+    recently used entries are evicted once the cache, zoom tiles included,
+    exceeds max_bytes.
+    """
+
+    CHUNK = 64 * 1024
+    # index.json is written at most this often (seconds); flush() at exit
+    SAVE_DELAY = 2.0
+
+    def __init__(self, directory, max_bytes, fresh_for=3600.0):
+        self.directory = directory
+        self.blob_dir = os.path.join(directory, "blobs")
+        self.index_path = os.path.join(directory, "index.json")
+        self.max_bytes = max_bytes
+        self.fresh_for = fresh_for
+        self._lock = threading.RLock()
+        self._write_lock = threading.Lock()
+        self._save_timer = None
+        os.makedirs(self.blob_dir, exist_ok=True)
+        self._index = self._load_index()
+
+    def _load_index(self):
+        try:
+            with open(self.index_path, encoding="utf-8") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = {}
+        index = {url: e for url, e in index.items()
+                 if os.path.exists(self._blob_path(e["hash"]))}
+        # Blobs the index lost track of (crash before a save, replaced bodies)
+        # and downloads that never finished would never be evicted
+        referenced = {e["hash"] for e in index.values()}
+        for name in os.listdir(self.blob_dir):
+            if name not in referenced:
+                self._remove_blob(name)
+        tiles = os.path.join(self.directory, "tiles")
+        for name in os.listdir(tiles) if os.path.isdir(tiles) else ():
+            if name not in referenced:
+                shutil.rmtree(os.path.join(tiles, name), ignore_errors=True)
+        for name in os.listdir(self.directory):
+            if name.endswith(".part"):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+        return index
+
+    def _save_index(self):
+        # Debounced: a burst of fetches (thumbnail prefetch) shares one write
+        with self._lock:
+            if self._save_timer is None:
+                self._save_timer = threading.Timer(self.SAVE_DELAY, self.flush)
+                self._save_timer.daemon = True
+                self._save_timer.start()
+
+    def flush(self):
+        """Write index.json now if changes are pending."""
+        with self._lock:
+            if self._save_timer is None:
+                return
+            self._save_timer.cancel()
+            self._save_timer = None
+            data = json.dumps(self._index)
+        with self._write_lock:
+            tmp = self.index_path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(data)
+            os.replace(tmp, self.index_path)
+
+    def _blob_path(self, digest):
+        return os.path.join(self.blob_dir, digest)
+
+    def _max_age(self, response):
+        for part in response.headers.get("Cache-Control", "").split(","):
+            part = part.strip().lower()
+            if part in ("no-cache", "no-store"):
+                return 0.0
+            if part.startswith("max-age="):
+                try:
+                    return float(part[8:])
+                except ValueError:
+                    pass
+        return self.fresh_for
+
+    def lookup(self, url):
+        """Path of a fresh cached copy of url, or None. Never hits the network."""
+        with self._lock:
+            entry = self._index.get(url)
+            if entry is None or time.time() > entry["expires"]:
+                return None
+            path = self._blob_path(entry["hash"])
+            if not os.path.exists(path):
+                return None
+            entry["last_access"] = time.time()
+            return path
+
+    def fetch(self, url, on_chunk=None, cancelled=lambda: False):
+        """Path of a local copy of url, downloading or revalidating as needed.
+
+        on_chunk(chunk, received, total) sees the body as it streams in; it
+        is not called when the copy on disk is used. Raising from it, or
+        cancelled() turning true, aborts the download.
+        """
+        path = self.lookup(url)
+        if path:
+            tracer.instant("http", "cache hit", url=url)
+            return path
+
+        with self._lock:
+            entry = self._index.get(url)
+        headers = {}
+        if entry:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        with get_http().get(url, headers=headers, cancelled=cancelled) as r:
+            if r.status_code == 304 and entry:
+                with self._lock:
+                    entry["expires"] = time.time() + self._max_age(r)
+                    entry["last_access"] = time.time()
+                    self._save_index()
+                return self._blob_path(entry["hash"])
+            r.raise_for_status()
+
+            digest = hashlib.sha256()
+            size = 0
+            total = int(r.headers.get("Content-Length") or 0) or None
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".part")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    for chunk in r.iter_content(self.CHUNK):
+                        f.write(chunk)
+                        digest.update(chunk)
+                        size += len(chunk)
+                        if on_chunk:
+                            on_chunk(chunk, size, total)
+                path = self._blob_path(digest.hexdigest())
+                os.replace(tmp, path)
+            except BaseException:
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+                raise
+
+            with self._lock:
+                now = time.time()
+                old = self._index.get(url)
+                self._index[url] = {
+                    "hash": digest.hexdigest(),
+                    "size": size,
+                    "etag": r.headers.get("ETag"),
+                    "last_modified": r.headers.get("Last-Modified"),
+                    "expires": now + self._max_age(r),
+                    "last_access": now,
+                }
+                # The URL's content changed: drop the old body unless another URL shares it
+                if old and old["hash"] != digest.hexdigest() and not any(
+                        e["hash"] == old["hash"] for e in self._index.values()):
+                    self._remove_blob(old["hash"])
+                self._evict(keep=digest.hexdigest())
+                self._save_index()
+        return path
+
+    def add_tiles(self, path, nbytes):
+        """Count nbytes of tiles built for the cached blob at path toward max_bytes."""
+        digest = os.path.basename(path)
+        with self._lock:
+            entries = [e for e in self._index.values() if e["hash"] == digest]
+            for entry in entries:
+                entry["tiles"] = entry.get("tiles", 0) + nbytes
+            if entries:
+                self._evict(keep=digest)
+                self._save_index()
+
+    def _evict(self, keep=None):
+        # Blobs can back several URLs; count and delete each one once.
+        # An entry's cost is its blob plus the zoom tiles derived from it.
+        blob_sizes = {e["hash"]: e["size"] + e.get("tiles", 0) for e in self._index.values()}
+        total = sum(blob_sizes.values())
+        by_age = sorted(self._index.items(), key=lambda item: item[1]["last_access"])
+        for url, entry in by_age:
+            if total <= self.max_bytes:
+                break
+            if entry["hash"] == keep:
+                continue
+            del self._index[url]
+            if not any(e["hash"] == entry["hash"] for e in self._index.values()):
+                total -= blob_sizes[entry["hash"]]
+                self._remove_blob(entry["hash"])
+
+    def _remove_blob(self, digest):
+        try:
+            os.remove(self._blob_path(digest))
+        except OSError:
+            pass
+        shutil.rmtree(os.path.join(self.directory, "tiles", digest), ignore_errors=True)
+
+    def tile_dir(self, path):
+        """Directory for derived tiles of the cached blob at path."""
+        return os.path.join(self.directory, "tiles", os.path.basename(path))
+
+
+_file_cache = None
+_file_cache_lock = threading.Lock()
+
+
+def get_file_cache():
+    global _file_cache
+    with _file_cache_lock:
+        if _file_cache is None:
+            _file_cache = FileCache(FILE_CACHE_DIR, int(FILE_CACHE_MAX_MB * 1024 * 1024),
+                                    FILE_CACHE_FRESH)
+        return _file_cache
+
+
+# ============================================================
+#   THUMBNAILS
+# ============================================================
+IMAGE_TYPES = ("imagen", "jpg", "png", "jpeg")
+THUMB_SIZE = (64, 64)
+THUMB_WORKERS = int(os.getenv("THUMB_WORKERS", "3"))
+
+
+def is_image(tipo):
+    return (tipo or "").lower() in IMAGE_TYPES
+
+
+def make_thumbnail(url, size=THUMB_SIZE, cancelled=lambda: False):
+    with Image.open(get_file_cache().fetch(url, cancelled=cancelled)) as img:
+        # JPEG can decode straight at a fraction of full size
+        img.draft("RGB", (size[0] * 2, size[1] * 2))
+        img.thumbnail(size)
+        return img.convert("RGB")
+
+
+class ThumbnailLoader:
+    """Bounded worker pool that downloads images and shrinks them to thumbnails.
+
+    request() queues a URL with a priority (lower runs first: rows in view
+    use 0, the rest of the list 1). Thumbnails become PhotoImages on the Tk
+    thread and are handed to on_ready(url, photo). cancel() drops everything
+    still queued; downloads already running finish but are not delivered.
+    shutdown() also aborts the running downloads.
+    """
+
+    POLL_MS = 50
+
+    def __init__(self, root, on_ready, workers=3, size=THUMB_SIZE, keep=500):
+        self.root = root
+        self.on_ready = on_ready
+        self.size = size
+        self.keep = keep
+        self.photos = OrderedDict()   # url -> PhotoImage, most recent last
+        self._failed = set()
+        self._heap = []
+        self._queued = {}             # url -> best queued priority
+        self._seq = itertools.count()
+        self._generation = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._results = queue.Queue()
+        for i in range(workers):
+            threading.Thread(target=self._work, name=f"thumbs-{i}", daemon=True).start()
+        self._after_id = self.root.after(self.POLL_MS, self._poll)
+
+    def get(self, url):
+        photo = self.photos.get(url)
+        if photo is not None:
+            self.photos.move_to_end(url)
+        return photo
+
+    def request(self, url, priority=1):
+        if url in self.photos or url in self._failed:
+            return
+        with self._cond:
+            current = self._queued.get(url)
+            if current is not None and current <= priority:
+                return
+            self._queued[url] = priority
+            heapq.heappush(self._heap, (priority, next(self._seq), url))
+            self._cond.notify()
+
+    def cancel(self):
+        with self._cond:
+            self._heap.clear()
+            self._queued.clear()
+            self._generation += 1
+
+    def shutdown(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self.cancel()
+        try:
+            self.root.after_cancel(self._after_id)
+        except tk.TclError:
+            pass
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._closed and not self._heap:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                priority, _, url = heapq.heappop(self._heap)
+                if self._queued.get(url) != priority:
+                    continue   # superseded by a higher-priority request
+                del self._queued[url]
+                generation = self._generation
+            try:
+                result = (generation, url, make_thumbnail(url, self.size,
+                                                          cancelled=lambda: self._closed), None)
+            except Exception as e:
+                result = (generation, url, None, e)
+            self._results.put(result)
+
+    def _poll(self):
+        while True:
+            try:
+                generation, url, img, error = self._results.get_nowait()
+            except queue.Empty:
+                break
+            if generation != self._generation:
+                continue
+            if error is not None:
+                self._failed.add(url)
+                continue
+            photo = ImageTk.PhotoImage(img)
+            self.photos[url] = photo
+            while len(self.photos) > self.keep:
+                self.photos.popitem(last=False)
+            self.on_ready(url, photo)
+        if not self._closed:
+            self._after_id = self.root.after(self.POLL_MS, self._poll)
+
+
+# ============================================================
+#   TILED VIEWER
+# ============================================================
+# Largest decode (in megapixels) a pyramid level may need; finer levels of
+# bigger images are not offered
+PYRAMID_MAX_MP = float(os.getenv("PYRAMID_MAX_MP", "24"))
+
+
+class TilePyramid:
+    """Lazily built tile pyramid for one cached image.
+
+    Level 0 is full resolution and every level above halves it. A level is
+    decoded once (JPEGs in draft mode), cut into TILE-sized tiles on disk
+    next to the cached blob and dropped from memory; after that tiles are
+    read back one at a time through a small in-memory LRU. Levels whose
+    decode would exceed max_pixels start at first_level instead of 0.
+    """
+
+    TILE = 256
+
+    def __init__(self, path, tile_dir, keep=64, max_pixels=int(PYRAMID_MAX_MP * 1e6),
+                 on_build=None):
+        self.path = path
+        self.tile_dir = tile_dir
+        self.keep = keep
+        self.on_build = on_build   # on_build(bytes written) after each level
+        with Image.open(path) as im:
+            self.size = im.size
+            self.has_alpha = im.mode in ("RGBA", "LA", "PA") or "transparency" in im.info
+        self.levels = 1
+        while max(self.level_size(self.levels - 1)) > self.TILE * 2:
+            self.levels += 1
+        self.first_level = next((level for level in range(self.levels)
+                                 if self._decode_pixels(level) <= max_pixels), self.levels)
+        self._tiles = OrderedDict()
+        self._lock = threading.Lock()
+        self._level_locks = {}
+
+    def _decode_pixels(self, level):
+        # draft() only rescales the header; non-JPEGs always decode in full
+        with Image.open(self.path) as im:
+            im.draft(None, self.level_size(level))
+            return im.size[0] * im.size[1]
+
+    @property
+    def zoomable(self):
+        """More than the fitted top level is available."""
+        return self.first_level < self.levels - 1
+
+    def level_size(self, level):
+        scale = 2 ** level
+        return (max(1, math.ceil(self.size[0] / scale)),
+                max(1, math.ceil(self.size[1] / scale)))
+
+    def grid(self, level):
+        w, h = self.level_size(level)
+        return math.ceil(w / self.TILE), math.ceil(h / self.TILE)
+
+    def _tile_path(self, level, tx, ty):
+        ext = "png" if self.has_alpha else "jpg"
+        return os.path.join(self.tile_dir, str(level), f"{tx}_{ty}.{ext}")
+
+    def tile(self, level, tx, ty):
+        key = (level, tx, ty)
+        with self._lock:
+            if key in self._tiles:
+                self._tiles.move_to_end(key)
+                return self._tiles[key]
+            level_lock = self._level_locks.setdefault(level, threading.Lock())
+        with level_lock:
+            if not os.path.exists(os.path.join(self.tile_dir, str(level), ".done")):
+                self._build_level(level)
+        with Image.open(self._tile_path(level, tx, ty)) as im:
+            im.load()
+        with self._lock:
+            self._tiles[key] = im
+            while len(self._tiles) > self.keep:
+                self._tiles.popitem(last=False)
+        return im
+
+    def _build_level(self, level):
+        target = self.level_size(level)
+        out_dir = os.path.join(self.tile_dir, str(level))
+        os.makedirs(out_dir, exist_ok=True)
+        mode = "RGBA" if self.has_alpha else "RGB"
+        with Image.open(self.path) as im:
+            im.draft(mode, target)
+            # convert() always copies; a decode already in the right mode is used as is
+            if im.mode == mode:
+                im.load()
+            else:
+                im = im.convert(mode)
+        if im.size != target:
+            im = im.resize(target, Image.LANCZOS)
+        cols, rows = self.grid(level)
+        T = self.TILE
+        written = 0
+        for ty in range(rows):
+            for tx in range(cols):
+                tile = im.crop((tx * T, ty * T, min((tx + 1) * T, target[0]),
+                                min((ty + 1) * T, target[1])))
+                tile_path = self._tile_path(level, tx, ty)
+                if self.has_alpha:
+                    tile.save(tile_path, "PNG")
+                else:
+                    tile.save(tile_path, "JPEG", quality=90)
+                written += os.path.getsize(tile_path)
+        open(os.path.join(out_dir, ".done"), "w").close()
+        if self.on_build:
+            self.on_build(written)
+
+
+class TiledImageViewer(tk.Frame):
+    """Pan/zoom viewer that only decodes the tiles intersecting the view.
+
+    Each zoom step is one pyramid level shown 1:1, so tiles are never
+    rescaled on the Tk thread. Drag to pan, mouse wheel or +/- to zoom.
+    """
+
+    POLL_MS = 30
+
+    def __init__(self, master, pyramid, **kw):
+        super().__init__(master, **kw)
+        self.pyramid = pyramid
+        self.level = pyramid.levels - 1
+        self.view_x = self.view_y = 0   # viewport origin, in level pixels
+        self._tiles = {}                # (tx, ty) -> (canvas item, PhotoImage)
+        self._wanted = frozenset()
+        self._requested = set()
+        self._generation = 0
+        self._fitted = False
+        self._drag = None
+        self._results = queue.Queue()
+        self._executor = ThreadPoolExecutor(2, thread_name_prefix="tiles")
+
+        self.canvas = tk.Canvas(self, bg=self["bg"], highlightthickness=0, cursor="fleur")
+        self.canvas.pack(fill="both", expand=True)
+        self.status = tk.Label(self, fg=MUTED, bg=self["bg"], font=("Segoe UI", 10))
+        self.status.pack(fill="x")
+
+        self.canvas.bind("<Configure>", self._on_configure)
+        self.canvas.bind("<ButtonPress-1>", self._on_press)
+        self.canvas.bind("<B1-Motion>", self._on_drag)
+        self.canvas.bind("<MouseWheel>", lambda e: self._on_wheel(e, e.delta > 0))
+        self.canvas.bind("<Button-4>", lambda e: self._on_wheel(e, True))
+        self.canvas.bind("<Button-5>", lambda e: self._on_wheel(e, False))
+        # The preview window outlives the viewer, so these are removed in _on_destroy
+        top = self.winfo_toplevel()
+        self._key_bindings = [(seq, top.bind(seq, lambda e, z=z: self.zoom(z)))
+                              for seq, z in (("<plus>", True), ("<minus>", False))]
+        self.bind("<Destroy>", self._on_destroy)
+        self._after_id = self.after(self.POLL_MS, self._poll)
+
+    def zoom(self, zoom_in, px=None, py=None):
+        level = self.level - 1 if zoom_in else self.level + 1
+        if not self.pyramid.first_level <= level < self.pyramid.levels:
+            return
+        if px is None:
+            px, py = self.canvas.winfo_width() // 2, self.canvas.winfo_height() // 2
+        # Keep the point under the cursor fixed
+        if zoom_in:
+            self.view_x = (self.view_x + px) * 2 - px
+            self.view_y = (self.view_y + py) * 2 - py
+        else:
+            self.view_x = (self.view_x + px) // 2 - px
+            self.view_y = (self.view_y + py) // 2 - py
+        self.level = level
+        self._generation += 1
+        self._requested.clear()
+        for item, _ in self._tiles.values():
+            self.canvas.delete(item)
+        self._tiles.clear()
+        get_scheduler(self).request(self._update)
+
+    def _on_configure(self, e):
+        if not self._fitted and e.width > 1:
+            # Start on the most detailed level that fits the window
+            self._fitted = True
+            while self.level > self.pyramid.first_level:
+                w, h = self.pyramid.level_size(self.level - 1)
+                if w > e.width or h > e.height:
+                    break
+                self.level -= 1
+        get_scheduler(self).request(self._update)
+
+    def _on_press(self, e):
+        self._drag = (e.x, e.y)
+
+    def _on_drag(self, e):
+        dx, dy = e.x - self._drag[0], e.y - self._drag[1]
+        self._drag = (e.x, e.y)
+        self.view_x -= dx
+        self.view_y -= dy
+        get_scheduler(self).request(self._update)
+
+    def _on_wheel(self, e, zoom_in):
+        self.zoom(zoom_in, e.x, e.y)
+        return "break"
+
+    def _clamp(self, view, length, viewport):
+        if length <= viewport:
+            return -((viewport - length) // 2)
+        return max(0, min(view, length - viewport))
+
+    def _update(self):
+        T = self.pyramid.TILE
+        w, h = self.canvas.winfo_width(), self.canvas.winfo_height()
+        lw, lh = self.pyramid.level_size(self.level)
+        self.view_x = self._clamp(self.view_x, lw, w)
+        self.view_y = self._clamp(self.view_y, lh, h)
+        cols, rows = self.pyramid.grid(self.level)
+
+        tx0, tx1 = max(0, self.view_x // T), min(cols - 1, (self.view_x + w - 1) // T)
+        ty0, ty1 = max(0, self.view_y // T), min(rows - 1, (self.view_y + h - 1) // T)
+        wanted = frozenset((tx, ty) for tx in range(tx0, tx1 + 1) for ty in range(ty0, ty1 + 1))
+        self._wanted = wanted
+
+        for key in list(self._tiles):
+            if key not in wanted:
+                self.canvas.delete(self._tiles.pop(key)[0])
+        for key in wanted:
+            if key in self._tiles:
+                self.canvas.coords(self._tiles[key][0],
+                                   key[0] * T - self.view_x, key[1] * T - self.view_y)
+            elif key not in self._requested:
+                self._request(key)
+
+        zoom = 100 / 2 ** self.level
+        self.status.config(text=f"{self.pyramid.size[0]}×{self.pyramid.size[1]}  ·  {zoom:g}%  ·  "
+                                "arrastra para mover, rueda o +/- para acercar")
+
+    def _request(self, key):
+        self._requested.add(key)
+        generation, level = self._generation, self.level
+
+        def load():
+            # Skip tiles that scrolled out of view while queued
+            if generation != self._generation or key not in self._wanted:
+                return None
+            return self.pyramid.tile(level, *key)
+
+        future = self._executor.submit(load)
+        future.add_done_callback(lambda f: self._results.put((generation, key, f)))
+
+    def _poll(self):
+        T = self.pyramid.TILE
+        while True:
+            try:
+                generation, key, future = self._results.get_nowait()
+            except queue.Empty:
+                break
+            self._requested.discard(key)
+            if generation != self._generation or key not in self._wanted:
+                continue
+            if future.exception() is not None:
+                self.status.config(text=f"Error al generar mosaico: {future.exception()}")
+                continue
+            tile = future.result()
+            if tile is None or key in self._tiles:
+                continue
+            photo = ImageTk.PhotoImage(tile)
+            item = self.canvas.create_image(key[0] * T - self.view_x, key[1] * T - self.view_y,
+                                            image=photo, anchor="nw")
+            self._tiles[key] = (item, photo)
+        self._after_id = self.after(self.POLL_MS, self._poll)
+
+    def _on_destroy(self, e):
+        if e.widget is not self:
+            return
+        self._generation += 1
+        self.after_cancel(self._after_id)
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        try:
+            top = self.winfo_toplevel()
+            for seq, funcid in self._key_bindings:
+                top.unbind(seq, funcid)
+        except tk.TclError:
+            pass   # the window is going away too
+
+
+# ============================================================
+#   PDF VIEWER
+# ============================================================
+PDF_PAGE_CACHE = int(os.getenv("PDF_PAGE_CACHE", "8"))
+
+
+class PdfViewer(tk.Frame):
+    """Scrolling PDF viewer that rasterizes pages on demand with PyMuPDF.
+
+    A single worker thread owns the PyMuPDF document (it is not thread-safe)
+    and renders only the pages in or next to the view, page 1 first. At
+    most cache_pages rendered pages are kept; the rest are placeholders
+    sized like page 1.
+    """
+
+    POLL_MS = 30
+    GAP = 12
+
+    def __init__(self, master, url, cache_pages=PDF_PAGE_CACHE, **kw):
+        super().__init__(master, **kw)
+        self.url = url
+        self.cache_pages = cache_pages
+        self.page_count = 0
+        self.slot_w = self.slot_h = 0
+        self._page_ratio = 1.414
+        self._doc = None
+        self._pages = OrderedDict()     # index -> (canvas item, PhotoImage)
+        self._requested = set()
+        self._wanted = frozenset()
+        self._closed = False
+        self._results = queue.Queue()
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="pdf")
+
+        self.canvas = tk.Canvas(self, bg=self["bg"], highlightthickness=0)
+        scrollbar = tk.Scrollbar(self, orient="vertical", command=self._yview)
+        scrollbar.pack(side="right", fill="y")
+        self.canvas.pack(side="left", fill="both", expand=True)
+        self.canvas.configure(yscrollcommand=scrollbar.set)
+        self.status = self.canvas.create_text(20, 20, anchor="nw", fill=MUTED,
+                                              font=("Segoe UI", 13), text="Cargando documento…")
+
+        self.canvas.bind("<Configure>", lambda e: get_scheduler(self).request(self._update))
+        self.canvas.bind("<MouseWheel>", lambda e: self._scroll(int(-e.delta / 120)))
+        self.canvas.bind("<Button-4>", lambda e: self._scroll(-1))
+        self.canvas.bind("<Button-5>", lambda e: self._scroll(1))
+        self.bind("<Destroy>", self._on_destroy)
+
+        self._submit("open", self._open_document)
+        self._after_id = self.after(self.POLL_MS, self._poll)
+
+    # -- worker side --------------------------------------------------
+    def _open_document(self):
+        path = get_file_cache().fetch(self.url, cancelled=lambda: self._closed)
+        self._doc = pymupdf.open(path)
+        first = self._doc[0].rect
+        return self._doc.page_count, first.width, first.height
+
+    def _render(self, index, width):
+        if self._closed or index not in self._wanted:
+            return None
+        page = self._doc[index]
+        zoom = width / page.rect.width
+        pix = page.get_pixmap(matrix=pymupdf.Matrix(zoom, zoom), alpha=False)
+        return Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+
+    def _submit(self, kind, fn, *args):
+        future = self._executor.submit(fn, *args)
+        future.add_done_callback(lambda f: self._results.put((kind, args, f)))
+
+    # -- Tk side ------------------------------------------------------
+    def _scroll(self, units):
+        self.canvas.yview_scroll(units, "units")
+        get_scheduler(self).request(self._update)
+        return "break"
+
+    def _yview(self, *args):
+        self.canvas.yview(*args)
+        get_scheduler(self).request(self._update)
+
+    def _update(self):
+        if not self.page_count:
+            return
+        width = self.canvas.winfo_width()
+        if not self.slot_w and width > 1:
+            self.slot_w = width - 2 * self.GAP
+            self.slot_h = int(self.slot_w * self._page_ratio)
+            self.canvas.configure(scrollregion=(0, 0, width, self.page_count * (self.slot_h + self.GAP)),
+                                  yscrollincrement=40)
+            for i in range(self.page_count):
+                y = self.GAP + i * (self.slot_h + self.GAP)
+                self.canvas.create_rectangle(self.GAP, y, self.GAP + self.slot_w, y + self.slot_h,
+                                             fill=BG1, outline="")
+        if not self.slot_w:
+            return
+
+        step = self.slot_h + self.GAP
+        top = self.canvas.canvasy(0)
+        bottom = top + self.canvas.winfo_height()
+        first = max(0, int(top // step) - 1)
+        last = min(self.page_count - 1, int(bottom // step) + 1)
+        self._wanted = frozenset(range(first, last + 1))
+
+        for index in range(first, last + 1):
+            if index in self._pages:
+                self._pages.move_to_end(index)
+            elif index not in self._requested:
+                self._requested.add(index)
+                self._submit("page", self._render, index, self.slot_w)
+
+    def _poll(self):
+        while True:
+            try:
+                kind, args, future = self._results.get_nowait()
+            except queue.Empty:
+                break
+            if future.cancelled():
+                continue
+            error = future.exception()
+            if kind == "open":
+                if error is not None:
+                    self.canvas.itemconfigure(self.status, text=f"No se pudo abrir el PDF.\n{error}")
+                    self.on_error(error)
+                    continue
+                self.page_count, page_w, page_h = future.result()
+                self._page_ratio = page_h / page_w
+                self.canvas.delete(self.status)
+                self._update()
+            else:
+                index = args[0]
+                self._requested.discard(index)
+                if error is not None or future.result() is None:
+                    continue
+                self._show_page(index, future.result())
+        if not self._closed:
+            self._after_id = self.after(self.POLL_MS, self._poll)
+
+    def _show_page(self, index, img):
+        img.thumbnail((self.slot_w, self.slot_h))
+        photo = ImageTk.PhotoImage(img)
+        y = self.GAP + index * (self.slot_h + self.GAP)
+        item = self.canvas.create_image(self.GAP + self.slot_w // 2, y, image=photo, anchor="n")
+        self._pages[index] = (item, photo)
+        # Drop the rendered pages furthest from the view
+        while len(self._pages) > self.cache_pages:
+            victim = next((i for i in self._pages if i not in self._wanted), None)
+            if victim is None:
+                break
+            self.canvas.delete(self._pages.pop(victim)[0])
+
+    def on_error(self, error):
+        """Hook for callers that want a fallback when the document can't be opened."""
+
+    def _on_destroy(self, e):
+        if e.widget is not self:
+            return
+        self._closed = True
+        self.after_cancel(self._after_id)
+
+        def close():
+            if self._doc is not None:
+                self._doc.close()
+        # Runs after any render already queued, on the thread that owns the document
+        self._executor.submit(close)
+        self._executor.shutdown(wait=False)
+
+
+# ============================================================
+#   FILE PREVIEW
+# ============================================================
+PREVIEW_SIZE = (650, 500)
+# Seconds between partial previews while an image is still downloading
+PREVIEW_PARTIAL_EVERY = 0.3
+# Budget for decoded previews kept in memory for instant re-opening
+PREVIEW_MEMORY_MB = float(os.getenv("PREVIEW_MEMORY_MB", "64"))
+
+
+class PreviewCancelled(RequestCancelled):
+    pass
+
+
+class ImageMemoryCache:
+    """LRU of decoded, already-fitted preview images within a byte budget.
+
+    The cost of an entry is its uncompressed size (width x height x bands).
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._images = OrderedDict()   # key -> (image, cost), most recent last
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._images.get(key)
+            if entry is None:
+                return None
+            self._images.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, img):
+        cost = img.width * img.height * len(img.getbands())
+        if cost > self.max_bytes:
+            return
+        with self._lock:
+            old = self._images.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self._images[key] = (img, cost)
+            self.bytes += cost
+            while self.bytes > self.max_bytes:
+                _, (_, evicted) = self._images.popitem(last=False)
+                self.bytes -= evicted
+
+    def clear(self):
+        with self._lock:
+            self._images.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {"images": len(self._images), "mb": round(self.bytes / 1048576, 1)}
+
+
+decoded_images = ImageMemoryCache(int(PREVIEW_MEMORY_MB * 1024 * 1024))
+
+
+@functools.lru_cache(maxsize=None)
+def _draft_parser_class():
+    # Built on first use so importing this module doesn't load PIL
+    class DraftParser(ImageFile.Parser):
+        """ImageFile.Parser that decodes JPEGs near a target size.
+
+        The image is put in draft mode before its decoder is created, so libjpeg
+        scales by 1/2, 1/4 or 1/8 while decoding and a 60 MP scan never exists
+        in memory at full resolution.
+        """
+
+        def __init__(self, target):
+            super().__init__()
+            self.target = target
+
+        def feed(self, data):
+            if self.image is not None or self.finished:
+                return super().feed(data)
+
+            self.data = data if self.data is None else self.data + data
+            try:
+                with BytesIO(self.data) as fp:
+                    im = Image.open(fp)
+            except OSError:
+                return  # header not complete yet
+            if im.format == "JPEG":
+                im.draft("RGB", self.target)
+
+            # Same decoder set-up as ImageFile.Parser, after the draft call.
+            # JpegImageFile defines load_read only to pad truncated files, so
+            # the parser would refuse it; its single tile decodes fine as a stream.
+            incremental = im.format == "JPEG" or not (hasattr(im, "load_seek") or hasattr(im, "load_read"))
+            if incremental and len(im.tile) == 1:
+                im.load_prepare()
+                d, e, o, a = im.tile[0]
+                im.tile = []
+                self.decoder = Image._getdecoder(im.mode, d, a, im.decoderconfig)
+                self.decoder.setimage(im.im, e)
+                self.offset = o
+            self.image = im
+
+            pending, self.data = self.data, None
+            super().feed(pending)
+
+    return DraftParser
+
+
+def make_draft_parser(target):
+    return _draft_parser_class()(target)
+
+
+def fit_image(img, size=PREVIEW_SIZE):
+    """Scale img down to fit size, keeping its aspect ratio."""
+    img = img.copy()
+    img.thumbnail(size)
+    return img
+
+
+def decode_fitted(path, size=PREVIEW_SIZE):
+    with Image.open(path) as img:
+        # thumbnail() puts JPEGs in draft mode before decoding
+        img.thumbnail(size)
+        return img.copy()
+
+
+def stream_preview(url, size=PREVIEW_SIZE, on_partial=None, on_progress=None,
+                   cancelled=lambda: False):
+    """Download url and decode it incrementally, returning the fitted image.
+
+    on_partial(img) receives scaled snapshots of what has been decoded so far.
+    Decoded images are kept in decoded_images under the blob's content hash,
+    so a file that changed on revalidation is decoded again; a fresh copy in
+    the file cache is decoded straight from disk.
+    """
+    path = get_file_cache().lookup(url)
+    img = None
+    if path is None:
+        img, path = _stream_preview(url, size, on_partial, on_progress, cancelled)
+    key = (os.path.basename(path), size)
+    if img is None:
+        img = decoded_images.get(key) or decode_fitted(path, size)
+    decoded_images.put(key, img)
+    return img
+
+
+def cached_preview(url, size=PREVIEW_SIZE):
+    """The decoded preview of url if its fresh cached blob is in memory. No I/O."""
+    path = get_file_cache().lookup(url)
+    return decoded_images.get((os.path.basename(path), size)) if path else None
+
+
+def _stream_preview(url, size, on_partial, on_progress, cancelled):
+    """(image, path) after downloading url; image is None when it has to be decoded from path."""
+    state = {"parser": make_draft_parser(size), "last_partial": time.monotonic()}
+
+    def on_chunk(chunk, received, total):
+        if cancelled():
+            raise PreviewCancelled()
+        if on_progress:
+            on_progress(received, total)
+        parser = state["parser"]
+        if parser is None:
+            return
+        try:
+            parser.feed(chunk)
+        except OSError:
+            state["parser"] = None   # corrupt stream; decode from disk at the end
+            return
+        if parser.image is not None and parser.decoder is None:
+            # Not incrementally decodable: stop buffering, read the cached file later
+            state["parser"] = None
+            return
+        now = time.monotonic()
+        if on_partial and parser.decoder and now - state["last_partial"] >= PREVIEW_PARTIAL_EVERY:
+            state["last_partial"] = now
+            on_partial(fit_image(parser.image, size))
+
+    path = get_file_cache().fetch(url, on_chunk=on_chunk, cancelled=cancelled)
+    parser = state["parser"]
+    if parser is None or parser.image is None:
+        # Revalidated with a 304, or the stream couldn't be decoded on the fly
+        return None, path
+    try:
+        return fit_image(parser.close(), size), path
+    except OSError:
+        return None, path
+
+
+class PreviewWindow(tk.Toplevel):
+    """The one "Vista de archivo" window, reused for every file.
+
+    show() swaps its content for another file and cancels whatever the
+    previous one was still loading. Closing only hides the window and drops
+    the bitmap on screen, so nothing piles up over a long session.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.title("Vista de archivo")
+        self.configure(bg=BG2)
+        self.protocol("WM_DELETE_WINDOW", self.close)
+        self.body = None
+        self._cancelled = threading.Event()
+
+    def close(self):
+        self._clear()
+        self.withdraw()
+
+    def _clear(self):
+        self._cancelled.set()
+        if self.body is not None:
+            self.body.destroy()
+            self.body = None
+
+    def show(self, url, tipo):
+        self._clear()
+        self._cancelled = threading.Event()
+        self.body = tk.Frame(self, bg=BG2)
+        self.body.pack(fill="both", expand=True)
+        self.deiconify()
+        self.lift()
+
+        tk.Label(self.body, text=tipo, fg=TEXT, bg=BG2,
+                 font=("Segoe UI", 18, "bold")).pack(pady=10)
+
+        if is_image(tipo):
+            self.geometry("700x600")
+            self._show_image(self.body, url, self._cancelled)
+        elif PYMUPDF_AVAILABLE:
+            self.geometry("820x900")
+            body = self.body
+            viewer = PdfViewer(body, url, bg=BG2)
+            viewer.pack(fill="both", expand=True, padx=10, pady=(0, 10))
+            # Not a document PyMuPDF can read: offer the browser instead
+            viewer.on_error = lambda e: tk.Button(
+                body, text="Abrir en el navegador", bg=PRIMARY, fg="black",
+                command=lambda: webbrowser.open(url), padx=20, pady=10).pack(before=viewer, pady=10)
+        else:
+            self.geometry("700x600")
+            tk.Label(self.body, text="No se puede renderizar PDF aquí.\nAbriré el archivo en el navegador.",
+                     fg=TEXT, bg=BG2, font=("Segoe UI", 14)).pack(pady=30)
+            tk.Button(self.body, text="Abrir PDF", bg=PRIMARY, fg="black",
+                      command=lambda: webbrowser.open(url),
+                      padx=20, pady=10).pack()
+
+    def _show_image(self, body, url, cancelled):
+        label = tk.Label(body, text="Cargando imagen…", fg=MUTED, bg=BG2,
+                         font=("Segoe UI", 13))
+        label.pack(expand=True)
+        status = tk.Label(body, text="", fg=MUTED, bg=BG2, font=("Segoe UI", 10))
+        status.pack(pady=(0, 8))
+
+        updates = queue.Queue()
+
+        def progress(received, total):
+            if total:
+                updates.put(("status", f"{received * 100 // total}% de {total / 1048576:.1f} MB"))
+            else:
+                updates.put(("status", f"{received / 1048576:.1f} MB"))
+
+        # Seen recently: paint now, the worker only prepares the zoom
+        cached = cached_preview(url)
+
+        def worker():
+            try:
+                if cached is None:
+                    img = stream_preview(url, on_partial=lambda im: updates.put(("image", im)),
+                                         on_progress=progress, cancelled=cancelled.is_set)
+                    updates.put(("done", img))
+            except RequestCancelled:
+                return
+            except Exception as e:
+                updates.put(("error", e))
+                return
+            # The preview is on screen; without a pyramid there is just no zoom
+            try:
+                cache = get_file_cache()
+                path = cache.lookup(url) or cache.fetch(url, cancelled=cancelled.is_set)
+                pyramid = TilePyramid(path, cache.tile_dir(path),
+                                      on_build=lambda n, p=path: cache.add_tiles(p, n))
+            except RequestCancelled:
+                return
+            except Exception as e:
+                print(f"Zoom not available for {url}: {e}")
+                pyramid = None
+            updates.put(("pyramid", pyramid))
+
+        zoom_btn = tk.Button(body, text="🔍 Ampliar", bg=PRIMARY, fg="black",
+                             padx=20, pady=6, relief="flat", cursor="hand2",
+                             font=("Segoe UI", 11, "bold"), activebackground="#3dd5f3")
+
+        def open_zoom(pyramid):
+            # Swap the fitted preview for the tiled viewer at full resolution
+            label.destroy()
+            status.destroy()
+            zoom_btn.destroy()
+            self.geometry("1100x850")
+            TiledImageViewer(body, pyramid, bg=BG2).pack(fill="both", expand=True, padx=10, pady=(0, 10))
+
+        def show(img):
+            img_tk = ImageTk.PhotoImage(img)
+            label.config(image=img_tk, text="")
+            label.image = img_tk
+
+        def done(img):
+            show(img)
+            status.config(text=f"{img.width}×{img.height}")
+
+        def poll():
+            if cancelled.is_set():
+                return
+            while True:
+                try:
+                    kind, value = updates.get_nowait()
+                except queue.Empty:
+                    break
+                if kind == "image":
+                    show(value)
+                elif kind == "status":
+                    status.config(text=value)
+                elif kind == "done":
+                    done(value)
+                elif kind == "pyramid":
+                    if value is not None and value.zoomable:
+                        zoom_btn.config(command=lambda p=value: open_zoom(p))
+                        zoom_btn.pack(pady=(0, 10))
+                    return
+                else:
+                    label.config(image="", text="No se pudo cargar la imagen.", fg=TEXT)
+                    label.image = None
+                    status.config(text=str(value))
+                    return
+            self.after(50, poll)
+
+        if cached is not None:
+            done(cached)
+        threading.Thread(target=worker, daemon=True).start()
+        poll()
+
+
+_preview_window = None
+
+
+@traced("ui")
+def open_preview(url, tipo):
+    global _preview_window
+    if _preview_window is None or not _preview_window.winfo_exists():
+        _preview_window = PreviewWindow()
+    _preview_window.show(url, tipo)
+
+
+def close_preview():
+    if _preview_window is not None and _preview_window.winfo_exists():
+        _preview_window.close()
+
+
+# ============================================================
+#   LOGIN
+# ============================================================
+def check_password(password, stored_hash):
+    # Check if it's a bcrypt hash (starts with $2a$, $2b$, or $2y$)
+    password_valid = False
+
+    if stored_hash.startswith(('$2a$', '$2b$', '$2y$')):
+        # It's a bcrypt hash - use bcrypt to verify
+        try:
+            password_valid = bcrypt.checkpw(password.encode('utf-8'), stored_hash.encode('utf-8'))
+        except Exception as e:
+            password_valid = False
+    else:
+        # Try other hash algorithms (SHA256, MD5, SHA1)
+        password_hash_sha256 = hashlib.sha256(password.encode('utf-8')).hexdigest()
+        password_hash_md5 = hashlib.md5(password.encode('utf-8')).hexdigest()
+        password_hash_sha1 = hashlib.sha1(password.encode('utf-8')).hexdigest()
+
+        stored_hash_lower = stored_hash.lower()
+        stored_hash_upper = stored_hash.upper()
+
+        password_valid = (
+            stored_hash == password_hash_sha256 or
+            stored_hash == password_hash_md5 or
+            stored_hash == password_hash_sha1 or
+            stored_hash_lower == password_hash_sha256 or
+            stored_hash_lower == password_hash_md5 or
+            stored_hash_lower == password_hash_sha1 or
+            stored_hash_upper == password_hash_sha256.upper() or
+            stored_hash_upper == password_hash_md5.upper() or
+            stored_hash_upper == password_hash_sha1.upper()
+        )
+
+    return password_valid
+
+
+PATIENT_COLUMNS = """
+    p.id, p.fecha_nacimiento, p.sexo, p.altura, p.peso,
+    p.estilo_vida, p.id_tipo_sangre, p.id_ocupacion,
+    p.id_estado_civil, p.id_medico_gen
+"""
+
+
+def _patient_from_row(row):
+    return {
+        "id": row[0],
+        "fecha_nac": str(row[1]),
+        "sexo": row[2],
+        "altura": str(row[3]),
+        "peso": str(row[4]),
+        "estilo": row[5],
+        "tipo_sangre": row[6],
+        "ocupacion": row[7],
+        "estado_civil": row[8],
+        "medico_gen": row[9]
+    }
+
+
+queries.register("paciente_by_id", f"""
+    SELECT {PATIENT_COLUMNS}
+    FROM paciente p
+    WHERE p.id = %s
+""")
+
+
+@traced("sql")
+def get_patient_by_id(patient_id):
+    with db_connection() as conn:
+        cur = conn.cursor()
+        queries.execute(cur, "paciente_by_id", (patient_id,))
+        row = cur.fetchone()
+
+    if not row:
+        return None
+    return _patient_from_row(row)
+
+
+queries.register("login", f"""
+    SELECT u.id, u.username, u.rol_id, u.password_hash,
+           {PATIENT_COLUMNS}
+    FROM usuario u
+    LEFT JOIN paciente p ON p.usuario_id = u.id
+    WHERE u.username = %s
+    LIMIT 1
+""")
+
+
+@traced("sql")
+def authenticate(username, password):
+    """Validate credentials and load the patient in a single round trip.
+
+    Returns (user, paciente, error). paciente is None when the user exists
+    but is not a patient. Meant to run off the Tk thread: bcrypt alone
+    takes 100-300 ms.
+    """
+    try:
+        with db_connection() as conn:
+            cur = conn.cursor()
+            queries.execute(cur, "login", (username,))
+            row = cur.fetchone()
+    except (psycopg2.OperationalError, PoolTimeout) as e:
+        return None, None, db_error_message(e)
+    except Exception as e:
+        return None, None, f"Error al validar usuario: {str(e)}"
+
+    if not row:
+        return None, None, f"Usuario '{username}' no encontrado en la base de datos."
+
+    user_id, db_username, rol_id, stored_hash = row[:4]
+
+    if not stored_hash:
+        return None, None, "El usuario no tiene password_hash configurado."
+
+    if not check_password(password, stored_hash):
+        return None, None, "Contraseña incorrecta. Verifica tu contraseña."
+
+    user = {"id": user_id, "username": db_username, "rol": rol_id}
+    paciente = _patient_from_row(row[4:]) if row[4] is not None else None
+    return user, paciente, None
+
+
+# ============================================================
+#   LOOKUP TABLES + SCHEMA
+# ============================================================
+LOOKUP_TTL = float(os.getenv("LOOKUP_TTL", "600"))
+
+
+class LookupCache:
+    """In-process copy of the small reference tables, refreshed after a TTL.
+
+    Ids resolve from memory; an unknown id forces one early refresh in case
+    the row was added after the last load.
+    """
+
+    QUERIES = {
+        "tipo_sangre": "SELECT id, tipo FROM tipo_sangre",
+        "ocupacion": "SELECT id, nombre FROM ocupacion",
+        "estado_civil": "SELECT id, nombre FROM estado_civil",
+    }
+    MISS_REFRESH_INTERVAL = 5.0
+
+    def __init__(self, ttl=600.0):
+        self.ttl = ttl
+        self._tables = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def _age(self):
+        if self._loaded_at is None:
+            return float("inf")
+        return time.monotonic() - self._loaded_at
+
+    def refresh(self):
+        tables = {}
+        with db_connection() as conn:
+            cur = conn.cursor()
+            for name, sql in self.QUERIES.items():
+                cur.execute(sql)
+                tables[name] = dict(cur.fetchall())
+        with self._lock:
+            self._tables = tables
+            self._loaded_at = time.monotonic()
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    def resolve(self, table, id_, default="N/A"):
+        if id_ is None:
+            return default
+        if self._age() > self.ttl:
+            self.refresh()
+        value = self._tables.get(table, {}).get(id_)
+        if value is None and self._age() > self.MISS_REFRESH_INTERVAL:
+            self.refresh()
+            value = self._tables.get(table, {}).get(id_)
+        return default if value is None else value
+
+
+lookups = LookupCache(LOOKUP_TTL)
+
+# Optional tables, detected once per process by detect_schema()
+_schema = {}
+_schema_lock = threading.Lock()
+
+
+def detect_schema():
+    with _schema_lock:
+        if not _schema:
+            with db_connection() as conn:
+                cur = conn.cursor()
+                cur.execute("""SELECT to_regclass('direccion_paciente') IS NOT NULL,
+                                      to_regclass('medico') IS NOT NULL""")
+                _schema["direccion_paciente"], _schema["medico"] = cur.fetchone()
+        return _schema
+
+
+def warm_up():
+    """Open the pool, detect the schema and load lookups while the login screen is idle."""
+    # Login needs bcrypt; previews need PIL and requests. Import them now,
+    # after the login window is up, instead of on the first click.
+    for module in (bcrypt, ImageTk, requests):
+        try:
+            module.load()
+        except ImportError as e:
+            print(f"Preload skipped: {e}")
+    try:
+        get_snapshots()
+        detect_schema()
+        lookups.refresh()
+    except Exception as e:
+        print(f"Warm-up skipped: {e}")
+
+
+GENERAL_INFO_FIELDS = ("Correo", "Teléfono", "Tipo de Sangre",
+                       "Ocupación", "Estado Civil", "Dirección")
+
+
+GENERAL_INFO_SQL = """
+    SELECT u.correo, u.telefono,
+           p.id_tipo_sangre, p.id_ocupacion, p.id_estado_civil,
+           {address_cols}
+    FROM paciente p
+    LEFT JOIN usuario u ON u.id = p.usuario_id
+    {address_join}
+    WHERE p.id = %s
+"""
+queries.register("general_info", GENERAL_INFO_SQL.format(
+    address_cols="NULL, NULL, NULL", address_join=""))
+queries.register("general_info_address", GENERAL_INFO_SQL.format(
+    address_cols="d.calle, d.numero_ext, d.numero_int",
+    address_join="""LEFT JOIN LATERAL (
+        SELECT calle, numero_ext, numero_int FROM direccion_paciente
+        WHERE paciente_id = p.id LIMIT 1
+    ) d ON TRUE"""))
+
+
+@traced("sql")
+def get_general_info(patient_id):
+    name = "general_info_address" if detect_schema().get("direccion_paciente") else "general_info"
+    with db_connection() as conn:
+        cur = conn.cursor()
+        queries.execute(cur, name, (patient_id,))
+        row = cur.fetchone() or (None,) * 8
+
+    correo, telefono, id_sangre, id_ocup, id_civil = row[:5]
+    d = row[5:]
+
+    # Format address if available
+    address = "N/A"
+    if d[0] and d[1]:
+        address = f"{d[0]} #{d[1]}"
+        if d[2]:
+            address += f" Int:{d[2]}"
+
+    return {
+        "Correo": correo or "N/A",
+        "Teléfono": telefono or "N/A",
+        "Tipo de Sangre": lookups.resolve("tipo_sangre", id_sangre),
+        "Ocupación": lookups.resolve("ocupacion", id_ocup),
+        "Estado Civil": lookups.resolve("estado_civil", id_civil),
+        "Dirección": address
+    }
+
+
+FILES_PAGE_SIZE = int(os.getenv("FILES_PAGE_SIZE", "100"))
+
+# Newest first, so a new upload is at the top of the list. A file can be
+# linked to the same patient twice, so archivo_id alone is not a key;
+# aa.id breaks the tie
+FILES_SQL = """
+    SELECT aa.archivo_id, aa.id, a.tipo, a.url, aa.descripcion
+    FROM archivo_asociacion aa
+    JOIN archivo a ON a.id = aa.archivo_id
+    WHERE aa.entidad = 'paciente' AND aa.entidad_id = %s
+"""
+FILES_ORDER = " ORDER BY aa.archivo_id DESC, aa.id DESC"
+
+
+queries.register("files_all", FILES_SQL + FILES_ORDER)
+queries.register("files_first_page", FILES_SQL + FILES_ORDER + " LIMIT %s")
+queries.register("files_after", FILES_SQL + " AND (aa.archivo_id, aa.id) < (%s, %s)"
+                 + FILES_ORDER + " LIMIT %s")
+
+
+@traced("sql")
+def get_files(patient_id):
+    with db_connection() as conn:
+        cur = conn.cursor()
+        queries.execute(cur, "files_all", (patient_id,))
+        rows = cur.fetchall()
+
+    return [(desc or "Archivo", tipo, url) for _, _, tipo, url, desc in rows]
+
+
+@traced("sql")
+def get_files_page(patient_id, after=None, limit=FILES_PAGE_SIZE):
+    """One keyset page of files, newest (archivo_id, association id) first.
+
+    Returns (files, next_after); next_after is the key to pass back as
+    `after`, or None once the last page is read.
+    """
+    with db_connection() as conn:
+        cur = conn.cursor()
+        if after is None:
+            queries.execute(cur, "files_first_page", (patient_id, limit))
+        else:
+            queries.execute(cur, "files_after", (patient_id, *after, limit))
+        rows = cur.fetchall()
+
+    files = [(desc or "Archivo", tipo, url) for _, _, tipo, url, desc in rows]
+    next_after = tuple(rows[-1][:2]) if len(rows) == limit else None
+    return files, next_after
+
+
+ROSTER_BATCH = int(os.getenv("ROSTER_BATCH", "500"))
+
+# ORDER BY p.id lets an index on (id_medico_gen, id) return each page
+# without sorting the whole roster
+ROSTER_SQL = """
+    SELECT p.id, u.username, p.sexo, p.fecha_nacimiento
+    FROM paciente p
+    LEFT JOIN usuario u ON u.id = p.usuario_id
+    WHERE p.id_medico_gen = %s
+"""
+
+
+queries.register("roster_first_page", ROSTER_SQL + " ORDER BY p.id LIMIT %s")
+queries.register("roster_after", ROSTER_SQL + " AND p.id > %s ORDER BY p.id LIMIT %s")
+
+
+@traced("sql")
+def get_physician_id(user_id):
+    """medico.id for a physician's user, or None if the user isn't one.
+
+    Only a row in the medico table grants access to a roster; without that
+    table nobody is treated as a physician.
+    """
+    if not detect_schema().get("medico"):
+        return None
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT id FROM medico WHERE usuario_id = %s", (user_id,))
+        row = cur.fetchone()
+    return row[0] if row else None
+
+
+@traced("sql")
+def get_roster_page(medico_id, after_id=None, limit=ROSTER_BATCH):
+    """One keyset page of a physician's patients, ordered by paciente id.
+
+    Rows are (paciente_id, username, sexo, fecha_nacimiento). Returns
+    (rows, next_after); next_after is None once the last page is read.
+    """
+    with db_connection() as conn:
+        cur = conn.cursor()
+        if after_id is None:
+            queries.execute(cur, "roster_first_page", (medico_id, limit))
+        else:
+            queries.execute(cur, "roster_after", (medico_id, after_id, limit))
+        rows = cur.fetchall()
+
+    patients = [(pid, name or f"Paciente {pid}", sexo or "N/A", str(born) if born else "N/A")
+                for pid, name, sexo, born in rows]
+    next_after = rows[-1][0] if len(rows) == limit else None
+    return patients, next_after
+
+
+# ============================================================
+#   BATCH SUMMARIES (headless)
+# ============================================================
+SUMMARY_SQL = """
+    SELECT p.id, u.username AS usuario, u.correo, u.telefono,
+           p.fecha_nacimiento, p.sexo, p.altura, p.peso, p.estilo_vida,
+           ts.tipo AS tipo_sangre, o.nombre AS ocupacion, ec.nombre AS estado_civil,
+           p.id_medico_gen, {address} AS direccion, f.archivos
+    FROM paciente p
+    LEFT JOIN usuario u ON u.id = p.usuario_id
+    LEFT JOIN tipo_sangre ts ON ts.id = p.id_tipo_sangre
+    LEFT JOIN ocupacion o ON o.id = p.id_ocupacion
+    LEFT JOIN estado_civil ec ON ec.id = p.id_estado_civil
+    {address_join}
+    LEFT JOIN LATERAL (
+        SELECT count(*) AS archivos FROM archivo_asociacion
+        WHERE entidad = 'paciente' AND entidad_id = p.id
+    ) f ON TRUE
+    {where}
+    ORDER BY p.id
+"""
+# Same format as get_general_info: "calle #ext Int:int"
+SUMMARY_ADDRESS = """CASE WHEN d.calle IS NOT NULL AND d.numero_ext IS NOT NULL
+        THEN concat(d.calle, ' #', d.numero_ext,
+                    CASE WHEN coalesce(d.numero_int::text, '') <> '' THEN ' Int:' || d.numero_int END)
+    END"""
+
+
+def summary_sql(cur, medico_id=None):
+    """The summary query for every patient, or one physician's, with parameters inlined.
+
+    COPY takes no bind parameters, so the filter is quoted with mogrify.
+    """
+    if detect_schema().get("direccion_paciente"):
+        address, address_join = SUMMARY_ADDRESS, """LEFT JOIN LATERAL (
+        SELECT calle, numero_ext, numero_int FROM direccion_paciente
+        WHERE paciente_id = p.id LIMIT 1
+    ) d ON TRUE"""
+    else:
+        address, address_join = "NULL::text", ""
+    where = ""
+    if medico_id is not None:
+        where = cur.mogrify("WHERE p.id_medico_gen = %s", (medico_id,)).decode()
+    return SUMMARY_SQL.format(address=address, address_join=address_join, where=where)
+
+
+def export_summaries(out, fmt="csv", medico_id=None, batch_size=ROSTER_BATCH):
+    """Stream one summary row per patient to the text file out; returns the row count.
+
+    Lookups, address and file counts are resolved by PostgreSQL in a single
+    query. CSV goes through COPY ... TO STDOUT straight into out; JSONL is
+    read from a server-side cursor batch_size rows at a time, each row
+    already serialized by row_to_json.
+    """
+    # Cached after the first call; done now so it doesn't borrow a second
+    # pooled connection while this one is held (warm_up never runs here)
+    detect_schema()
+    with db_connection() as conn:
+        cur = conn.cursor()
+        sql = summary_sql(cur, medico_id)
+        if fmt == "csv":
+            with tracer.span("sql", "summaries copy") as args:
+                cur.copy_expert(f"COPY ({sql}) TO STDOUT WITH (FORMAT csv, HEADER)", out)
+                args["rows"] = cur.rowcount
+            return cur.rowcount
+
+        count = 0
+        with conn.cursor(name="summaries") as named:
+            named.itersize = batch_size
+            named.execute(f"SELECT row_to_json(s)::text FROM ({sql}) s")
+            while True:
+                rows = named.fetchmany(batch_size)
+                if not rows:
+                    break
+                out.writelines(row[0] + "\n" for row in rows)
+                count += len(rows)
+        return count
+
+
+def summaries_main(argv):
+    """python patient_dashboard.py --export-summaries [options]; no Tk window is created."""
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog="patient_dashboard.py --export-summaries",
+        description="Exporta un resumen por paciente (datos, catálogos, dirección y "
+                    "número de archivos) a CSV o JSONL.")
+    parser.add_argument("--format", choices=("csv", "jsonl"), default="csv")
+    parser.add_argument("--output", "-o", default="-", help="archivo de salida (- = stdout)")
+    parser.add_argument("--medico", type=int, help="solo los pacientes de este id_medico_gen")
+    parser.add_argument("--batch-size", type=int, default=ROSTER_BATCH,
+                        help="filas por lote del cursor en JSONL")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    try:
+        if args.output == "-":
+            count = export_summaries(sys.stdout, args.format, args.medico, args.batch_size)
+            sys.stdout.flush()
+        else:
+            with open(args.output, "w", encoding="utf-8", newline="") as out:
+                count = export_summaries(out, args.format, args.medico, args.batch_size)
+    except (psycopg2.Error, PoolTimeout) as e:
+        print(db_error_message(e), file=sys.stderr)
+        return 1
+    except BrokenPipeError:
+        # Reader went away (e.g. piped into head); keep the exit flush quiet
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 1
+    finally:
+        close_pool()
+    print(f"{count} pacientes en {time.perf_counter() - start:.2f} s", file=sys.stderr)
+    return 0
+
+
+# ============================================================
+#   BACKGROUND LOADING
+# ============================================================
+class BackgroundLoader:
+    """Runs blocking calls on a worker pool and hands results to the Tk thread.
+
+    Workers push finished futures onto a queue that the mainloop drains with
+    root.after. Every submit() belongs to a channel; cancel(channel) drops
+    whatever is still in flight there so stale results never reach the UI.
+    """
+
+    POLL_MS = 30
+
+    def __init__(self, root, max_workers=4):
+        self.root = root
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix="loader")
+        self._results = queue.Queue()
+        self._tokens = {}     # channel -> current generation
+        self._pending = {}    # channel -> set of futures
+        self._closed = False
+        self._after_id = self.root.after(self.POLL_MS, self._poll)
+
+    def submit(self, channel, fn, *args, on_done=None, on_error=None):
+        if self._closed:
+            return None
+        token = self._tokens.setdefault(channel, 0)
+        future = self._executor.submit(fn, *args)
+        self._pending.setdefault(channel, set()).add(future)
+        future.add_done_callback(
+            lambda f: self._results.put((channel, token, f, on_done, on_error)))
+        return future
+
+    def cancel(self, channel=None):
+        channels = list(self._tokens) if channel is None else [channel]
+        for ch in channels:
+            self._tokens[ch] = self._tokens.get(ch, 0) + 1
+            for future in self._pending.pop(ch, ()):
+                future.cancel()
+
+    def shutdown(self):
+        if self._closed:
+            return
+        self._closed = True
+        self.cancel()
+        if self._after_id is not None:
+            try:
+                self.root.after_cancel(self._after_id)
+            except tk.TclError:
+                pass
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _poll(self):
+        self._after_id = None
+        while True:
+            try:
+                channel, token, future, on_done, on_error = self._results.get_nowait()
+            except queue.Empty:
+                break
+            self._pending.get(channel, set()).discard(future)
+            if self._closed or future.cancelled() or token != self._tokens.get(channel):
+                continue
+            exc = future.exception()
+            if exc is None:
+                if on_done:
+                    on_done(future.result())
+            elif on_error:
+                on_error(exc)
+            else:
+                print(f"Background task failed: {exc}")
+        if not self._closed:
+            self._after_id = self.root.after(self.POLL_MS, self._poll)
+
+
+# ============================================================
+#   VIRTUAL LIST
+# ============================================================
+class VirtualList(tk.Frame):
+    """Scrollable list that only creates widgets for the rows in view.
+
+    Rows have a fixed height. A small pool of row widgets built by make_row()
+    is re-bound with bind_row(widget, item) as the user scrolls. on_near_end
+    fires when the view gets close to the last loaded item so the caller can
+    append another page with extend().
+    """
+
+    # The dashboard's mouse wheel handler scrolls the innermost widget
+    # carrying this flag instead of the outer canvas.
+    wheel_target = True
+
+    def __init__(self, master, row_height, make_row, bind_row,
+                 on_near_end=None, overscan=3, **kw):
+        super().__init__(master, **kw)
+        self.row_height = row_height
+        self.make_row = make_row
+        self.bind_row = bind_row
+        self.on_near_end = on_near_end
+        self.overscan = overscan
+        self.items = []
+        self._pool = []      # [widget, window_id, bound_index]
+
+        self.canvas = tk.Canvas(self, bg=self["bg"], highlightthickness=0)
+        self.canvas.pack(side="left", fill="both", expand=True)
+        scrollbar = tk.Scrollbar(self, orient="vertical", command=self.yview)
+        scrollbar.pack(side="right", fill="y")
+        self.canvas.configure(yscrollcommand=scrollbar.set)
+        self.canvas.bind("<Configure>", lambda e: self.schedule_refresh())
+
+    def set_items(self, items):
+        self.items = list(items)
+        for slot in self._pool:
+            slot[2] = None
+        self.canvas.yview_moveto(0)
+        self.schedule_refresh()
+
+    def extend(self, items):
+        self.items.extend(items)
+        self.schedule_refresh()
+
+    def update_items(self, items):
+        """Swap in a new item list in place: the scroll position is kept and
+        only the bound rows whose item changed are re-bound."""
+        old, self.items = self.items, list(items)
+        for slot in self._pool:
+            index = slot[2]
+            if index is None:
+                continue
+            if index >= len(self.items):
+                slot[2] = None
+            elif old[index] != self.items[index]:
+                self.bind_row(slot[0], self.items[index])
+        self.schedule_refresh()
+
+    def schedule_refresh(self):
+        get_scheduler(self).request(self._refresh)
+
+    def bound_rows(self):
+        """(widget, item) for every row currently bound, i.e. in or near view."""
+        return [(slot[0], self.items[slot[2]]) for slot in self._pool if slot[2] is not None]
+
+    def yview(self, *args):
+        self.canvas.yview(*args)
+        self.schedule_refresh()
+
+    def yview_scroll(self, number, what):
+        self.canvas.yview_scroll(number, what)
+        self.schedule_refresh()
+
+    def _refresh(self):
+        rh = self.row_height
+        width = self.canvas.winfo_width()
+        height = self.canvas.winfo_height()
+        self.canvas.configure(scrollregion=(0, 0, width, len(self.items) * rh),
+                              yscrollincrement=rh // 3)
+        top = self.canvas.canvasy(0)
+        first = max(0, int(top // rh) - self.overscan)
+        last = min(len(self.items), int((top + height) // rh) + 1 + self.overscan)
+
+        while len(self._pool) < last - first:
+            widget = self.make_row(self.canvas)
+            window_id = self.canvas.create_window(0, -rh, window=widget,
+                                                  anchor="nw", height=rh)
+            self._pool.append([widget, window_id, None])
+
+        # Keep rows that are still in view bound to the same item; hand the
+        # rest to the indexes that just scrolled in.
+        wanted = set(range(first, last))
+        free = []
+        for slot in self._pool:
+            if slot[2] in wanted:
+                wanted.discard(slot[2])
+            else:
+                free.append(slot)
+        for index in sorted(wanted):
+            slot = free.pop()
+            self.bind_row(slot[0], self.items[index])
+            slot[2] = index
+        for slot in free:
+            # Park unused rows above the scroll region
+            slot[2] = None
+            self.canvas.coords(slot[1], 0, -rh)
+        for slot in self._pool:
+            if slot[2] is not None:
+                self.canvas.coords(slot[1], 0, slot[2] * rh)
+                self.canvas.itemconfigure(slot[1], width=width)
+
+        if self.on_near_end and last >= len(self.items) - self.overscan:
+            self.on_near_end()
+
+
+# ============================================================
+#   SESSION CACHE
+# ============================================================
+SESSION_CACHE_TTL = float(os.getenv("SESSION_CACHE_TTL", "300"))
+
+
+class SessionCache:
+    """Per-session store of tab data with an explicit TTL."""
+
+    def __init__(self, ttl=300.0):
+        self.ttl = ttl
+        self._entries = {}   # key -> (value, stored_at)
+
+    def put(self, key, value):
+        self._entries[key] = (value, time.monotonic())
+
+    def get(self, key, default=None):
+        entry = self._entries.get(key)
+        if entry is None or time.monotonic() - entry[1] > self.ttl:
+            return default
+        return entry[0]
+
+    def is_fresh(self, key):
+        entry = self._entries.get(key)
+        return entry is not None and time.monotonic() - entry[1] <= self.ttl
+
+    def invalidate(self, key=None):
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
+
+
+# ============================================================
+#   SNAPSHOT STORE
+# ============================================================
+# Fernet key (Fernet.generate_key()); without it, or without the
+# cryptography package, nothing is written to disk
+SNAPSHOT_KEY = os.getenv("SNAPSHOT_KEY", "")
+SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH", os.path.join(
+    os.path.dirname(_default_cache_dir()), "snapshots.sqlite3"))
+SNAPSHOT_MAX_AGE = float(os.getenv("SNAPSHOT_MAX_AGE", str(30 * 86400)))
+
+
+class SnapshotStore:
+    """Encrypted last-known copy of each patient's tab data, in SQLite.
+
+    The dashboard paints from it right after login and then revalidates
+    against PostgreSQL. Payloads are JSON encrypted with Fernet; one that no
+    longer decrypts (the key changed) or is older than max_age is a miss.
+    """
+
+    def __init__(self, path, key, max_age=SNAPSHOT_MAX_AGE):
+        self.max_age = max_age
+        self._fernet = fernet.Fernet(key)
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS snapshot (
+                paciente_id INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                payload BLOB NOT NULL,
+                saved_at REAL NOT NULL,
+                PRIMARY KEY (paciente_id, kind)
+            )
+        """)
+
+    def get(self, paciente_id, kind):
+        with self._lock:
+            row = self._db.execute("SELECT payload, saved_at FROM snapshot "
+                                   "WHERE paciente_id = ? AND kind = ?", (paciente_id, kind)).fetchone()
+        if row is None or time.time() - row[1] > self.max_age:
+            return None
+        try:
+            return json.loads(self._fernet.decrypt(row[0]))
+        except (fernet.InvalidToken, ValueError):
+            self.delete(paciente_id, kind)
+            return None
+
+    def put(self, paciente_id, kind, data):
+        payload = self._fernet.encrypt(json.dumps(data).encode("utf-8"))
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO snapshot VALUES (?, ?, ?, ?)",
+                             (paciente_id, kind, payload, time.time()))
+
+    def delete(self, paciente_id, kind=None):
+        with self._lock:
+            if kind is None:
+                self._db.execute("DELETE FROM snapshot WHERE paciente_id = ?", (paciente_id,))
+            else:
+                self._db.execute("DELETE FROM snapshot WHERE paciente_id = ? AND kind = ?",
+                                 (paciente_id, kind))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+_snapshots = None
+_snapshots_lock = threading.Lock()
+
+
+def get_snapshots():
+    """The shared SnapshotStore, or None when snapshots are disabled."""
+    global _snapshots
+    if not SNAPSHOT_KEY or not CRYPTOGRAPHY_AVAILABLE:
+        return None
+    with _snapshots_lock:
+        if _snapshots is None:
+            try:
+                _snapshots = SnapshotStore(SNAPSHOT_PATH, SNAPSHOT_KEY.encode("ascii"))
+            except (ValueError, OSError, sqlite3.Error) as e:
+                print(f"Snapshots disabled: {e}")
+                _snapshots = False
+        return _snapshots or None
+
+
+# ============================================================
+#   CHANGE NOTIFICATIONS
+# ============================================================
+# Set DB_LISTEN=0 to turn the listener off (e.g. behind pgbouncer in
+# transaction mode, where LISTEN doesn't work)
+DB_LISTEN = os.getenv("DB_LISTEN", "1") != "0"
+NOTIFY_CHANNEL = "paciente_cambio"
+
+# Table named in a notification -> parts of the dashboard built from it
+NOTIFY_TABS = {
+    "paciente": ("summary", "paciente"),
+    "usuario": ("paciente",),
+    "direccion_paciente": ("paciente",),
+    "archivo_asociacion": ("partes",),
+}
+
+
+class ChangeListener:
+    """LISTENs for row changes on a dedicated autocommit connection.
+
+    notify_triggers.sql makes PostgreSQL send {"paciente_id", "tabla"} on
+    NOTIFY_CHANNEL. A worker thread waits on the socket with select() and
+    queues the tables that changed for patient_id; the Tk thread drains the
+    queue every poll_ms and calls on_change(tables) once per batch, so a
+    burst of inserts costs one refresh. After a reconnect the set holds
+    None: notifications may have been missed, so everything is stale.
+    """
+
+    RECONNECT_DELAYS = (1, 2, 5, 10, 30)
+
+    def __init__(self, root, on_change, patient_id=None, poll_ms=100):
+        self.root = root
+        self.on_change = on_change
+        self.patient_id = patient_id
+        self.poll_ms = poll_ms
+        self._pending = queue.Queue()
+        self._stopped = threading.Event()
+        self._after_id = None
+
+    def start(self):
+        threading.Thread(target=self._run, name="db-listen", daemon=True).start()
+        self._poll()
+
+    def stop(self):
+        self._stopped.set()
+        if self._after_id is not None:
+            try:
+                self.root.after_cancel(self._after_id)
+            except tk.TclError:
+                pass
+            self._after_id = None
+
+    def _connect(self):
+        conn = psycopg2.connect(keepalives=1, keepalives_idle=30, **DB_CONFIG)
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute(f"LISTEN {NOTIFY_CHANNEL}")
+        return conn
+
+    def _run(self):
+        failures = 0
+        connected_before = False
+        while not self._stopped.is_set():
+            try:
+                conn = self._connect()
+            except psycopg2.Error as e:
+                delay = self.RECONNECT_DELAYS[min(failures, len(self.RECONNECT_DELAYS) - 1)]
+                if failures == 0:
+                    print(f"Change listener could not connect, retrying: {e}")
+                failures += 1
+                self._stopped.wait(delay)
+                continue
+            if connected_before:
+                self._pending.put(None)
+            connected_before = True
+            failures = 0
+            try:
+                self._listen(conn)
+            except (psycopg2.Error, OSError) as e:
+                print(f"Change listener lost its connection: {e}")
+            finally:
+                conn.close()
+
+    def _listen(self, conn):
+        while not self._stopped.is_set():
+            # Wake up every second to notice stop()
+            if not select.select([conn], [], [], 1.0)[0]:
+                continue
+            conn.poll()
+            while conn.notifies:
+                self._dispatch(conn.notifies.pop(0))
+
+    def _dispatch(self, notify):
+        try:
+            data = json.loads(notify.payload)
+        except ValueError:
+            return
+        if self.patient_id is not None and data.get("paciente_id") != self.patient_id:
+            return
+        tracer.instant("sql", "notify", **data)
+        self._pending.put(data.get("tabla"))
+
+    def _poll(self):
+        if self._stopped.is_set():
+            return
+        tables = set()
+        while True:
+            try:
+                tables.add(self._pending.get_nowait())
+            except queue.Empty:
+                break
+        if tables:
+            self.on_change(tables)
+        self._after_id = self.root.after(self.poll_ms, self._poll)
+
+
+# ============================================================
+#   EXPORT
+# ============================================================
+EXPORT_WORKERS = int(os.getenv("EXPORT_WORKERS", "4"))
+
+
+def export_entry_name(desc, tipo, url):
+    """Stable file name for one file in the export.
+
+    The URL hash keeps names unique and identical across runs, which is
+    what lets an interrupted export pick up where it stopped.
+    """
+    base = "".join(c if c.isalnum() or c in " -_" else "_" for c in desc).strip()[:60] or "archivo"
+    ext = os.path.splitext(urlparse(url).path)[1][1:]
+    if not ext:
+        # tipo can be a MIME type ("image/png"); keep only its last part
+        ext = "jpg" if is_image(tipo) else (tipo or "").rsplit("/", 1)[-1]
+    # Letters and digits only: no path separators on disk or in the ZIP
+    ext = "".join(c for c in ext.lower() if c.isalnum())[:8] or "bin"
+    return f"{base}_{hashlib.sha1(url.encode()).hexdigest()[:10]}.{ext}"
+
+
+@traced("http")
+def export_patient(patient_id, zip_path, on_progress=None, cancelled=lambda: False,
+                   workers=EXPORT_WORKERS):
+    """Write a patient's profile and every file into a ZIP at zip_path.
+
+    Files are streamed to disk in <zip_path>.partial/ by up to `workers`
+    parallel downloads, so nothing is held in memory, and are then copied
+    into the ZIP chunk by chunk. Files already in the partial directory are
+    skipped, so running the export again resumes it. Returns the files that
+    could not be downloaded as {name: error}; the partial directory is kept
+    while any remain so a later run retries only those.
+
+    on_progress(done, total, bytes) is called from this thread.
+    """
+    staging = zip_path + ".partial"
+    files_dir = os.path.join(staging, "archivos")
+    os.makedirs(files_dir, exist_ok=True)
+
+    profile = {
+        "paciente": get_patient_by_id(patient_id),
+        "informacion_general": get_general_info(patient_id),
+        "exportado": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    with open(os.path.join(staging, "perfil.json"), "w", encoding="utf-8") as f:
+        json.dump(profile, f, ensure_ascii=False, indent=2, default=str)
 
-# Load environment variables from .env file
-load_dotenv()
+    entries = {}
+    for desc, tipo, url in get_files(patient_id):
+        entries.setdefault(export_entry_name(desc, tipo, url), (desc, tipo, url))
 
-# Global flag to track login status
-login_successful = threading.Event()
+    pending = {name for name in entries if not os.path.exists(os.path.join(files_dir, name))}
+    done = len(entries) - len(pending)
+    received = sum(os.path.getsize(os.path.join(files_dir, name))
+                   for name in entries if name not in pending)
+    failures = {}
+    if on_progress:
+        on_progress(done, len(entries), received)
 
-# Avatar URL
-AVATAR_URL = "https://stunning-crisp-51ccb2.netlify.app/"
+    def download(name):
+        url = entries[name][2]
+        target = os.path.join(files_dir, name)
+        tmp = target + ".tmp"
+        cached = get_file_cache().lookup(url)
+        try:
+            if cached:
+                shutil.copyfile(cached, tmp)
+            else:
+                with get_http().get(url, cancelled=cancelled) as r:
+                    r.raise_for_status()
+                    with open(tmp, "wb") as f:
+                        for chunk in r.iter_content(FileCache.CHUNK):
+                            f.write(chunk)
+            os.replace(tmp, target)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+        return os.path.getsize(target)
 
-# ============================================================
-#   CONFIG DB - Docker PostgreSQL
-# ============================================================
-DB_CONFIG = {
-    "host": os.getenv("DB_HOST", os.getenv("POSTGRES_HOST", "localhost")),
-    "port": int(os.getenv("DB_PORT", os.getenv("POSTGRES_PORT", "5432"))),
-    "dbname": os.getenv("DB_NAME", os.getenv("POSTGRES_DB", "medico_db")),
-    "user": os.getenv("DB_USER", os.getenv("POSTGRES_USER", "admin")),
-    "password": os.getenv("DB_PASSWORD", os.getenv("POSTGRES_PASSWORD", "admin123"))
-}
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="export") as pool:
+        futures = {pool.submit(download, name): name for name in entries if name in pending}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                received += future.result()
+            except RequestCancelled:
+                pass
+            except (requests.RequestException, OSError) as e:
+                failures[name] = str(e)
+            done += 1
+            if on_progress:
+                on_progress(done, len(entries), received)
+            if cancelled():
+                for f in futures:
+                    f.cancel()
+                break
+    if cancelled():
+        raise RequestCancelled()
 
-def db_connect():
-    try:
-        conn = psycopg2.connect(**DB_CONFIG)
-        return conn
-    except psycopg2.OperationalError as e:
-        error_msg = f"Error de conexión a la base de datos:\n{str(e)}\n\nVerifica que:\n- Docker esté corriendo\n- PostgreSQL esté accesible en {DB_CONFIG['host']}:{DB_CONFIG['port']}\n- Las credenciales en .env sean correctas"
-        messagebox.showerror("Error de Conexión", error_msg)
-        return None
-    except Exception as e:
-        messagebox.showerror("DB Error", f"Error inesperado: {str(e)}")
-        return None
+    with open(os.path.join(staging, "archivos.csv"), "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["archivo", "descripcion", "tipo", "url", "estado"])
+        for name, (desc, tipo, url) in entries.items():
+            writer.writerow([f"archivos/{name}", desc, tipo, url,
+                             "error" if name in failures else "ok"])
 
+    tmp_zip = zip_path + ".tmp"
+    with zipfile.ZipFile(tmp_zip, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.write(os.path.join(staging, "perfil.json"), "perfil.json")
+        zf.write(os.path.join(staging, "archivos.csv"), "archivos.csv")
+        for name in entries:
+            path = os.path.join(files_dir, name)
+            if os.path.exists(path):
+                # jpg/pdf are already compressed
+                zf.write(path, f"archivos/{name}", compress_type=zipfile.ZIP_STORED)
+    os.replace(tmp_zip, zip_path)
 
-# ============================================================
-#   COLORS
-# ============================================================
-BG1 = "#0b1220"
-BG2 = "#0a1730"
-CARD = "#1a2333"
-TEXT = "#e6f0ff"
-MUTED = "#9bb3d1"
-PRIMARY = "#52e5ff"
-DANGER = "#ff5c7c"
+    if not failures:
+        shutil.rmtree(staging, ignore_errors=True)
+    return failures
 
 
-# ============================================================
-#   FILE PREVIEW
-# ============================================================
-def open_preview(url, tipo):
-    modal = tk.Toplevel()
-    modal.title("Vista de archivo")
-    modal.geometry("700x600")
-    modal.configure(bg=BG2)
+def _format_bytes(n):
+    for unit in ("B", "KB", "MB"):
+        if n < 1024:
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024
+    return f"{n:.2f} GB"
 
-    tk.Label(modal, text=tipo, fg=TEXT, bg=BG2,
-             font=("Segoe UI", 18, "bold")).pack(pady=10)
 
-    if tipo.lower() in ["imagen", "jpg", "png", "jpeg"]:
-        try:
-            img_data = requests.get(url).content
-            img = Image.open(BytesIO(img_data))
-            img = img.resize((650, 500))
-            img_tk = ImageTk.PhotoImage(img)
+def open_export_dialog(root, paciente):
+    """Ask where to save and run export_patient with a progress window."""
+    window = getattr(root, "export_window", None)
+    if window is not None and window.winfo_exists():
+        window.lift()
+        return
 
-            label = tk.Label(modal, image=img_tk, bg=BG2)
-            label.image = img_tk
-            label.pack()
-        except:
-            tk.Label(modal, text="No se pudo cargar la imagen.",
-                     fg=TEXT, bg=BG2).pack(pady=30)
+    path = filedialog.asksaveasfilename(parent=root, title="Exportar expediente",
+                                        defaultextension=".zip", filetypes=[("ZIP", "*.zip")],
+                                        initialfile=f"expediente_{paciente['id']}.zip")
+    if not path:
+        return
+    resuming = os.path.isdir(path + ".partial")
 
-    else:
-        tk.Label(modal, text="No se puede renderizar PDF aquí.\nAbriré el archivo en el navegador.",
-                 fg=TEXT, bg=BG2, font=("Segoe UI", 14)).pack(pady=30)
-        tk.Button(modal, text="Abrir PDF", bg=PRIMARY, fg="black",
-                  command=lambda: webbrowser.open(url),
-                  padx=20, pady=10).pack()
+    win = root.export_window = tk.Toplevel(root)
+    win.title("Exportar expediente")
+    win.geometry("480x170")
+    win.configure(bg=BG1)
+    win.transient(root)
 
+    status = tk.Label(win, text="Reanudando exportación…" if resuming else "Preparando exportación…",
+                      fg=TEXT, bg=BG1, font=("Segoe UI", 12))
+    status.pack(anchor="w", padx=20, pady=(20, 8))
+    bar = ttk.Progressbar(win, mode="determinate", maximum=1)
+    bar.pack(fill="x", padx=20)
+    detail = tk.Label(win, text="", fg=MUTED, bg=BG1, font=("Segoe UI", 10))
+    detail.pack(anchor="w", padx=20, pady=(6, 0))
 
-# ============================================================
-#   LOGIN
-# ============================================================
-def validate_user(username, password):
-    conn = db_connect()
-    if not conn:
-        return None, "No se pudo conectar a la base de datos."
+    cancelled = threading.Event()
+    updates = queue.Queue()
 
-    try:
-        cur = conn.cursor()
+    def cancel():
+        cancelled.set()
+        status.config(text="Cancelando…")
+        cancel_btn.config(state="disabled")
 
-        # First, get the user by username to retrieve password_hash
-        cur.execute("""
-            SELECT id, username, rol_id, password_hash FROM usuario
-            WHERE username = %s
-        """, (username,))
+    cancel_btn = tk.Button(win, text="Cancelar", command=cancel, fg=TEXT, bg=BG2,
+                           relief="flat", padx=12, pady=4, cursor="hand2")
+    cancel_btn.pack(anchor="e", padx=20, pady=10)
+    win.protocol("WM_DELETE_WINDOW", cancel)
+    # Logout destroys every window; don't keep downloading with nothing on screen
+    win.bind("<Destroy>", lambda e: cancelled.set() if e.widget is win else None)
 
-        row = cur.fetchone()
-        
-        if not row:
-            conn.close()
-            return None, f"Usuario '{username}' no encontrado en la base de datos."
+    def worker():
+        try:
+            failures = export_patient(paciente["id"], path, cancelled=cancelled.is_set,
+                                      on_progress=lambda *p: updates.put(("progress", p)))
+            updates.put(("done", failures))
+        except RequestCancelled:
+            updates.put(("cancelled", None))
+        except Exception as e:
+            updates.put(("error", e))
 
-        user_id, db_username, rol_id, stored_hash = row[0], row[1], row[2], row[3]
-        
-        if not stored_hash:
-            conn.close()
-            return None, "El usuario no tiene password_hash configurado."
+    def finish(kind, value):
+        win.destroy()
+        if kind == "done" and not value:
+            messagebox.showinfo("Exportación completa", f"Expediente guardado en:\n{path}")
+        elif kind == "done":
+            messagebox.showwarning(
+                "Exportación incompleta",
+                f"{len(value)} archivo(s) no se pudieron descargar. Vuelve a exportar al mismo "
+                f"archivo para reintentar solo esos.")
+        elif kind == "cancelled":
+            messagebox.showinfo("Exportación cancelada",
+                                "Vuelve a exportar al mismo archivo para continuar donde se quedó.")
+        else:
+            messagebox.showerror("Error", db_error_message(value))
 
-        # Check if it's a bcrypt hash (starts with $2a$, $2b$, or $2y$)
-        password_valid = False
-        
-        if stored_hash.startswith(('$2a$', '$2b$', '$2y$')):
-            # It's a bcrypt hash - use bcrypt to verify
+    def poll():
+        if not win.winfo_exists():
+            return
+        while True:
             try:
-                password_valid = bcrypt.checkpw(password.encode('utf-8'), stored_hash.encode('utf-8'))
-            except Exception as e:
-                password_valid = False
-        else:
-            # Try other hash algorithms (SHA256, MD5, SHA1)
-            password_hash_sha256 = hashlib.sha256(password.encode('utf-8')).hexdigest()
-            password_hash_md5 = hashlib.md5(password.encode('utf-8')).hexdigest()
-            password_hash_sha1 = hashlib.sha1(password.encode('utf-8')).hexdigest()
-            
-            stored_hash_lower = stored_hash.lower()
-            stored_hash_upper = stored_hash.upper()
-            
-            password_valid = (
-                stored_hash == password_hash_sha256 or
-                stored_hash == password_hash_md5 or
-                stored_hash == password_hash_sha1 or
-                stored_hash_lower == password_hash_sha256 or
-                stored_hash_lower == password_hash_md5 or
-                stored_hash_lower == password_hash_sha1 or
-                stored_hash_upper == password_hash_sha256.upper() or
-                stored_hash_upper == password_hash_md5.upper() or
-                stored_hash_upper == password_hash_sha1.upper()
-            )
+                kind, value = updates.get_nowait()
+            except queue.Empty:
+                break
+            if kind != "progress":
+                finish(kind, value)
+                return
+            done, total, received = value
+            bar.config(maximum=max(total, 1), value=done)
+            if not cancelled.is_set():
+                status.config(text=f"Descargando archivos… {done}/{total}")
+            detail.config(text=_format_bytes(received))
+        win.after(100, poll)
 
-        if password_valid:
-            conn.close()
-            return {"id": user_id, "username": db_username, "rol": rol_id}, None
-        else:
-            conn.close()
-            return None, "Contraseña incorrecta. Verifica tu contraseña."
-        
-    except Exception as e:
-        if conn:
-            conn.close()
-        return None, f"Error al validar usuario: {str(e)}"
+    threading.Thread(target=worker, name="export", daemon=True).start()
+    poll()
 
 
-def get_patient_by_user(user_id):
-    conn = db_connect()
-    cur = conn.cursor()
+# ============================================================
+#   AVATAR PROCESS
+# ============================================================
+AVATAR_WIDTH = 600
+AVATAR_HEIGHT = 650
+# AVATAR=0 runs without the avatar window (headless runs, benchmarks)
+AVATAR_ENABLED = os.getenv("AVATAR", "1") != "0"
 
-    cur.execute("""
-        SELECT id, fecha_nacimiento, sexo, altura, peso,
-               estilo_vida, id_tipo_sangre, id_ocupacion,
-               id_estado_civil, id_medico_gen
-        FROM paciente
-        WHERE usuario_id = %s
-    """, (user_id,))
 
-    row = cur.fetchone()
-    conn.close()
+class AvatarProcess:
+    """Single long-lived avatar_window.py process driven over local IPC.
 
-    if not row:
-        return None
-    return {
-        "id": row[0],
-        "fecha_nac": str(row[1]),
-        "sexo": row[2],
-        "altura": str(row[3]),
-        "peso": str(row[4]),
-        "estilo": row[5],
-        "tipo_sangre": row[6],
-        "ocupacion": row[7],
-        "estado_civil": row[8],
-        "medico_gen": row[9]
-    }
+    The process is started hidden (see start_tk) so pywebview and the avatar
+    page are loaded before anyone logs in. The dashboard then only sends
+    show/hide/move/resize/reload commands through an authenticated
+    multiprocessing.connection channel on 127.0.0.1. Commands sent before
+    the child connects are queued. A dead child is restarted on the next
+    command.
+    """
 
+    def __init__(self, script):
+        self.script = script
+        self.proc = None
+        self._listener = None
+        self._conn = None
+        self._backlog = []
+        self._lock = threading.Lock()
 
-def get_general_info(patient_id):
-    conn = db_connect()
-    cur = conn.cursor()
-
-    cur.execute("""
-        SELECT u.correo, u.telefono
-        FROM usuario u 
-        JOIN paciente p ON p.usuario_id = u.id
-        WHERE p.id = %s
-    """, (patient_id,))
-    u = cur.fetchone()
-
-    cur.execute("""
-        SELECT tipo FROM tipo_sangre WHERE id = (
-            SELECT id_tipo_sangre FROM paciente WHERE id = %s
-        );
-    """, (patient_id,))
-    sangre = (cur.fetchone() or ["N/A"])[0]
-
-    cur.execute("""
-        SELECT nombre FROM ocupacion WHERE id = (
-            SELECT id_ocupacion FROM paciente WHERE id = %s
-        );
-    """, (patient_id,))
-    ocup = (cur.fetchone() or ["N/A"])[0]
-
-    cur.execute("""
-        SELECT nombre FROM estado_civil WHERE id = (
-            SELECT id_estado_civil FROM paciente WHERE id = %s
-        );
-    """, (patient_id,))
-    civil = (cur.fetchone() or ["N/A"])[0]
-
-    # Try to get address, but handle if table doesn't exist
-    d = None
-    try:
-        cur.execute("""
-            SELECT calle, numero_ext, numero_int
-            FROM direccion_paciente
-            WHERE paciente_id = %s
-        """, (patient_id,))
-        d = cur.fetchone()
-    except Exception as e:
-        # Table doesn't exist or other error, skip address
-        # Check if it's an undefined table error
-        error_str = str(e)
-        if "direccion_paciente" in error_str.lower() or "does not exist" in error_str.lower():
-            pass  # Table doesn't exist, that's okay
-        else:
-            pass  # Other error, skip address
+    def running(self):
+        return self.proc is not None and self.proc.poll() is None
 
-    conn.close()
+    def start(self):
+        """Spawn the hidden avatar process if it isn't running. False if it can't be."""
+        with self._lock:
+            if self.running():
+                return True
+            self._close_channel()
+            if not os.path.exists(self.script):
+                return False
 
-    # Format address if available
-    address = "N/A"
-    if d and len(d) >= 3 and d[0] and d[1]:
-        address = f"{d[0]} #{d[1]}"
-        if d[2]:
-            address += f" Int:{d[2]}"
+            authkey = os.urandom(16)
+            self._listener = Listener(("127.0.0.1", 0), authkey=authkey)
+            host, port = self._listener.address
+            env = dict(os.environ, AVATAR_IPC_KEY=authkey.hex())
+            kwargs = {"stdout": subprocess.DEVNULL, "stderr": subprocess.DEVNULL, "env": env}
+            if sys.platform == 'win32':
+                # Use CREATE_NO_WINDOW to hide the console
+                kwargs["creationflags"] = subprocess.CREATE_NO_WINDOW
+            try:
+                self.proc = subprocess.Popen(
+                    [sys.executable, self.script, "--control", f"{host}:{port}"], **kwargs)
+            except OSError as e:
+                print(f"Error opening avatar: {e}")
+                self._close_channel()
+                return False
 
-    return {
-        "Correo": u[0] if u else "N/A",
-        "Teléfono": u[1] if u else "N/A",
-        "Tipo de Sangre": sangre,
-        "Ocupación": ocup,
-        "Estado Civil": civil,
-        "Dirección": address
-    }
+            listener = self._listener
+            threading.Thread(target=self._accept, args=(listener,),
+                             name="avatar-ipc", daemon=True).start()
+            return True
+
+    def _accept(self, listener):
+        try:
+            conn = listener.accept()
+        except (OSError, EOFError):
+            return   # listener closed, or the child failed the auth handshake
+        with self._lock:
+            if listener is not self._listener:
+                conn.close()
+                return
+            self._conn = conn
+            backlog, self._backlog = self._backlog, []
+        for message in backlog:
+            self._send(message)
+
+    def _send(self, message):
+        with self._lock:
+            if self._conn is None:
+                self._backlog.append(message)
+                return
+            try:
+                self._conn.send(message)
+            except (OSError, EOFError):
+                self._conn = None
 
+    def command(self, *message):
+        if not self.start():
+            return False
+        self._send(message)
+        return True
 
-def get_files(patient_id):
-    conn = db_connect()
-    cur = conn.cursor()
+    def show(self, x, y, width, height):
+        return (self.command("move", x, y) and self.command("resize", width, height)
+                and self.command("show"))
 
-    cur.execute("""
-        SELECT a.tipo, a.url, aa.descripcion
-        FROM archivo_asociacion aa
-        JOIN archivo a ON a.id = aa.archivo_id
-        WHERE aa.entidad = 'paciente' AND aa.entidad_id = %s
-    """, (patient_id,))
+    def hide(self):
+        if self.running():
+            self._send(("hide",))
 
-    rows = cur.fetchall()
-    conn.close()
+    def reload(self):
+        return self.command("reload")
 
-    return [(desc or "Archivo", tipo, url) for tipo, url, desc in rows]
+    def stop(self):
+        if self.running():
+            self._send(("quit",))
+            try:
+                self.proc.wait(timeout=3)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+        with self._lock:
+            self._close_channel()
+
+    def _close_channel(self):
+        for obj in (self._conn, self._listener):
+            if obj is not None:
+                try:
+                    obj.close()
+                except OSError:
+                    pass
+        self._conn = self._listener = None
+        self._backlog = []
+
+
+avatar = AvatarProcess(os.path.join(os.path.dirname(os.path.abspath(__file__)), "avatar_window.py"))
 
 
 # ============================================================
 #   DASHBOARD
 # ============================================================
-def show_dashboard(root, user, paciente):
+def _on_wheel(root, e):
+    # Scroll the innermost VirtualList under the pointer, else the page
+    target = getattr(root, "wheel_canvas", None)
+    try:
+        w = root.winfo_containing(e.x_root, e.y_root)
+    except KeyError:
+        w = None
+    while w is not None:
+        if getattr(w, "wheel_target", False):
+            target = w
+            break
+        w = w.master
+    if target is not None and target.winfo_exists():
+        target.yview_scroll(int(-e.delta / 120), "units")
+
+
+@traced("ui")
+def show_dashboard(root, user, paciente, title=None, on_back=None):
+    """The patient's tabs. A physician drilling down from the roster passes
+    a title and on_back, which adds a button back to the roster."""
 
     for w in root.winfo_children():
         w.destroy()
@@ -312,14 +3356,36 @@ def show_dashboard(root, user, paciente):
     header_content.pack(fill="both", expand=True, padx=30, pady=15)
     
     welcome_text = tk.Label(header_content, 
-                           text=f"Bienvenido, {user['username']}", 
+                           text=title or f"Bienvenido, {user['username']}", 
                            fg=TEXT, bg=BG2, font=("Segoe UI", 24, "bold"))
     welcome_text.pack(side="left")
     
+    loader = BackgroundLoader(root)
+    # Started the first time the files tab gets data
+    thumbs = None
+    blank_thumb = tk.PhotoImage(master=root, width=THUMB_SIZE[0], height=THUMB_SIZE[1])
+
     # Logout button
+    def close_session():
+        if RENDER_STATS:
+            print(f"Render scheduler: {scheduler.stats()}")
+        loader.shutdown()
+        if thumbs is not None:
+            thumbs.shutdown()
+        if listener is not None:
+            listener.stop()
+
     def logout():
+        close_session()
+        close_preview()
+        avatar.hide()
         login_successful.clear()
         show_login(root)
+
+    def back():
+        close_session()
+        close_preview()
+        on_back()
     
     logout_btn = tk.Button(header_content, text="Cerrar Sesión", 
                           bg=DANGER, fg="white", font=("Segoe UI", 11, "bold"),
@@ -327,6 +3393,11 @@ def show_dashboard(root, user, paciente):
                           cursor="hand2", activebackground="#ff3d5c")
     logout_btn.pack(side="right")
 
+    if on_back is not None:
+        tk.Button(header_content, text="← Pacientes", bg=BG1, fg=TEXT,
+                  font=("Segoe UI", 11, "bold"), padx=20, pady=8, command=back,
+                  relief="flat", cursor="hand2", activebackground=CARD).pack(side="right", padx=10)
+
     # Main container
     main_container = tk.Frame(root, bg=BG1)
     main_container.pack(fill="both", expand=True, padx=20, pady=20)
@@ -348,13 +3419,19 @@ def show_dashboard(root, user, paciente):
     scroll_frame = tk.Frame(canvas, bg=CARD)
     canvas.create_window((0, 0), window=scroll_frame, anchor="nw")
 
-    def update_region(e):
+    scheduler = get_scheduler(root)
+
+    def update_region():
         canvas.configure(scrollregion=canvas.bbox("all"))
-    scroll_frame.bind("<Configure>", update_region)
+    # Fires once per child geometry change; recompute the bbox once per pass
+    scroll_frame.bind("<Configure>", lambda e: scheduler.request(update_region))
 
-    def wheel(e):
-        canvas.yview_scroll(int(-e.delta / 120), "units")
-    canvas.bind_all("<MouseWheel>", wheel)
+    # The wheel handler is bound once per root and scrolls whatever page
+    # canvas the current dashboard registered
+    root.wheel_canvas = canvas
+    if not getattr(root, "wheel_bound", False):
+        root.bind_all("<MouseWheel>", lambda e: _on_wheel(root, e))
+        root.wheel_bound = True
 
     # TABS with better styling
     active_tab = tk.StringVar(value="paciente")
@@ -371,7 +3448,11 @@ def show_dashboard(root, user, paciente):
         else:
             paciente_btn.config(bg=BG2, fg=TEXT)
             partes_btn.config(bg=PRIMARY, fg="black")
-        draw()
+        if tab != "partes" and thumbs is not None:
+            thumbs.cancel()
+        show_tab(tab)
+        if tab == "partes":
+            resume_thumbnails()
 
     paciente_btn = tk.Button(tab_frame, text="📋 Información del Paciente", 
                             fg="black", bg=PRIMARY, relief="flat",
@@ -387,202 +3468,537 @@ def show_dashboard(root, user, paciente):
                           activebackground=BG1)
     partes_btn.pack(side="left", padx=5)
 
+    refresh_btn = tk.Button(tab_frame, text="⟳ Actualizar",
+                            fg=TEXT, bg=BG2, relief="flat",
+                            font=("Segoe UI", 11, "bold"), padx=15, pady=8,
+                            command=lambda: refresh(active_tab.get()), cursor="hand2",
+                            activebackground=BG1)
+    refresh_btn.pack(side="right", padx=5)
+
+    export_btn = tk.Button(tab_frame, text="📦 Exportar todo",
+                           fg=TEXT, bg=BG2, relief="flat",
+                           font=("Segoe UI", 11, "bold"), padx=15, pady=8,
+                           command=lambda: open_export_dialog(root, paciente), cursor="hand2",
+                           activebackground=BG1)
+    export_btn.pack(side="right", padx=5)
+
     # Content
     content = tk.Frame(scroll_frame, bg=CARD)
     content.pack(fill="both", expand=True)
 
-    def clear():
-        for w in content.winfo_children():
+    def skeleton_bar(parent, width):
+        return tk.Label(parent, text=" " * width, bg=BG1, font=("Segoe UI", 13))
+
+    def show_load_error(parent, e):
+        for w in parent.winfo_children():
             w.destroy()
+        tk.Label(parent, text="No se pudo cargar la información.", fg=DANGER, bg=parent["bg"],
+                 font=("Segoe UI", 13, "bold")).pack(anchor="w", pady=(0, 5))
+        tk.Label(parent, text=db_error_message(e), fg=MUTED, bg=parent["bg"],
+                 font=("Segoe UI", 11), justify="left").pack(anchor="w")
+
+    def summary_items(p):
+        return [
+            ("Sexo", p['sexo']),
+            ("Fecha de Nacimiento", p['fecha_nac']),
+            ("Altura", f"{p['altura']} cm"),
+            ("Peso", f"{p['peso']} kg")
+        ]
+
+    summary_labels = {}
+
+    def fill_summary(p):
+        if p is None:
+            return
+        paciente.update(p)
+        for label, value in summary_items(p):
+            widget = summary_labels.get(label)
+            if widget is not None and widget.winfo_exists() and widget.cget("text") != value:
+                widget.config(text=value)
+
+    def build_paciente_view(view):
+        # Title with icon
+        title_frame = tk.Frame(view, bg=CARD)
+        title_frame.pack(fill="x", pady=(0, 20))
+        tk.Label(title_frame, text="👤 Información del Paciente",
+                 fg=TEXT, bg=CARD,
+                 font=("Segoe UI", 26, "bold")).pack(side="left")
+
+        # Summary card with better styling
+        card = tk.Frame(view, bg=BG2, relief="flat")
+        card.pack(fill="x", pady=15, padx=10)
+        
+        # Add padding inside card
+        card_inner = tk.Frame(card, bg=BG2)
+        card_inner.pack(fill="both", expand=True, padx=20, pady=15)
+
+        for label, value in summary_items(paciente):
+            item_frame = tk.Frame(card_inner, bg=BG2)
+            item_frame.pack(fill="x", pady=8)
+            tk.Label(item_frame, text=f"{label}:", fg=MUTED, bg=BG2, 
+                    font=("Segoe UI", 12), width=20, anchor="w").pack(side="left")
+            summary_labels[label] = tk.Label(item_frame, text=value, fg=TEXT, bg=BG2,
+                                             font=("Segoe UI", 13, "bold"))
+            summary_labels[label].pack(side="left")
+
+        # General Info
+        tk.Label(view, text="📋 Información General",
+                 fg=TEXT, bg=CARD, font=("Segoe UI", 22, "bold")
+                 ).pack(anchor="w", pady=(30, 15), padx=10)
 
-    def draw():
-        clear()
-
-        if active_tab.get() == "paciente":
-            # Title with icon
-            title_frame = tk.Frame(content, bg=CARD)
-            title_frame.pack(fill="x", pady=(0, 20))
-            tk.Label(title_frame, text="👤 Información del Paciente",
-                     fg=TEXT, bg=CARD,
-                     font=("Segoe UI", 26, "bold")).pack(side="left")
-
-            # Summary card with better styling
-            card = tk.Frame(content, bg=BG2, relief="flat")
-            card.pack(fill="x", pady=15, padx=10)
-            
-            # Add padding inside card
-            card_inner = tk.Frame(card, bg=BG2)
-            card_inner.pack(fill="both", expand=True, padx=20, pady=15)
-
-            info_items = [
-                ("Sexo", paciente['sexo']),
-                ("Fecha de Nacimiento", paciente['fecha_nac']),
-                ("Altura", f"{paciente['altura']} cm"),
-                ("Peso", f"{paciente['peso']} kg")
-            ]
-            
-            for label, value in info_items:
-                item_frame = tk.Frame(card_inner, bg=BG2)
-                item_frame.pack(fill="x", pady=8)
-                tk.Label(item_frame, text=f"{label}:", fg=MUTED, bg=BG2, 
-                        font=("Segoe UI", 12), width=20, anchor="w").pack(side="left")
-                tk.Label(item_frame, text=value, fg=TEXT, bg=BG2, 
-                        font=("Segoe UI", 13, "bold")).pack(side="left")
-
-            # General Info
-            info = get_general_info(paciente["id"])
-
-            tk.Label(content, text="📋 Información General",
-                     fg=TEXT, bg=CARD, font=("Segoe UI", 22, "bold")
-                     ).pack(anchor="w", pady=(30, 15), padx=10)
-
-            # Info cards
-            info_card = tk.Frame(content, bg=BG2, relief="flat")
-            info_card.pack(fill="x", pady=10, padx=10)
-            
+        # Info cards
+        info_card = tk.Frame(view, bg=BG2, relief="flat")
+        info_card.pack(fill="x", pady=10, padx=10)
+
+        def build_rows():
             info_inner = tk.Frame(info_card, bg=BG2)
             info_inner.pack(fill="both", expand=True, padx=20, pady=20)
 
-            r = 0
-            for k, v in info.items():
+            # Skeleton rows until get_general_info() comes back
+            value_labels = {}
+            for k in GENERAL_INFO_FIELDS:
                 item_frame = tk.Frame(info_inner, bg=BG2)
                 item_frame.pack(fill="x", pady=10)
                 tk.Label(item_frame, text=k, fg=MUTED, bg=BG2,
                          font=("Segoe UI", 12), width=18, anchor="w").pack(side="left")
-                tk.Label(item_frame, text=v, fg=TEXT, bg=BG2,
-                         font=("Segoe UI", 13, "bold")).pack(side="left", padx=10)
-                r += 1
+                value_labels[k] = skeleton_bar(item_frame, 24)
+                value_labels[k].pack(side="left", padx=10)
+            return value_labels
 
-        else:
-            tk.Label(content, text="📁 Archivos Médicos",
-                     fg=TEXT, bg=CARD, font=("Segoe UI", 26, "bold")).pack(anchor="w", pady=(0, 20), padx=10)
+        value_labels = build_rows()
+        shown = {}
+
+        def fill_info(info):
+            nonlocal value_labels
+            if not value_labels[GENERAL_INFO_FIELDS[0]].winfo_exists():
+                # Previous attempt failed and replaced the rows with an error
+                for w in info_card.winfo_children():
+                    w.destroy()
+                value_labels = build_rows()
+                shown.clear()
+            # Revalidating over a snapshot: only touch the values that changed
+            for k, v in info.items():
+                if shown.get(k) != v:
+                    value_labels[k].config(text=v, fg=TEXT, bg=BG2,
+                                           font=("Segoe UI", 13, "bold"))
+                    shown[k] = v
+
+        return fill_info, lambda e: show_load_error(info_card, e)
+
+    FILE_ROW_HEIGHT = 96
+
+    def make_file_row(parent):
+        row = tk.Frame(parent, bg=CARD)
+        f = tk.Frame(row, bg=BG2, relief="flat")
+        f.pack(fill="both", expand=True, pady=(0, 10), padx=10)
+
+        # Always carries an image, so width/height stay in pixels
+        row.thumb = tk.Label(f, image=blank_thumb, bg=BG1, fg=MUTED,
+                             width=THUMB_SIZE[0], height=THUMB_SIZE[1],
+                             font=("Segoe UI", 20), compound="center")
+        row.thumb.pack(side="left", padx=(15, 0), pady=8)
+
+        file_info = tk.Frame(f, bg=BG2)
+        file_info.pack(side="left", fill="x", expand=True, padx=20, pady=15)
+
+        row.tipo_label = tk.Label(file_info, fg=PRIMARY, bg=BG2,
+                                  font=("Segoe UI", 12, "bold"))
+        row.tipo_label.pack(anchor="w")
+        row.name_label = tk.Label(file_info, fg=TEXT, bg=BG2,
+                                  font=("Segoe UI", 13))
+        row.name_label.pack(anchor="w", pady=2)
+
+        row.button = tk.Button(f, text="Ver archivo", bg=PRIMARY, fg="black",
+                               padx=20, pady=10, font=("Segoe UI", 11, "bold"),
+                               relief="flat", cursor="hand2",
+                               activebackground="#3dd5f3")
+        row.button.pack(side="right", padx=20, pady=15)
+        return row
+
+    def bind_file_row(row, item):
+        name, tipo, url = item
+        row.tipo_label.config(text=f"📄 {tipo}")
+        row.name_label.config(text=name)
+        row.button.config(command=lambda u=url, t=tipo: open_preview(u, t))
+
+        photo = thumbs.get(url) if thumbs is not None and is_image(tipo) else None
+        row.thumb.config(image=photo or blank_thumb, text="" if photo else ("🖼" if is_image(tipo) else "📄"))
+        if photo is None and is_image(tipo) and thumbs is not None:
+            # Rows in view jump ahead of the background prefetch
+            thumbs.request(url, priority=0)
+
+    def apply_thumbnail(url, photo):
+        vlist = views["partes"][0].vlist if "partes" in views else None
+        if vlist is None or not vlist.winfo_exists():
+            return
+        for row, (_, tipo, row_url) in vlist.bound_rows():
+            if row_url == url:
+                row.thumb.config(image=photo, text="")
 
-            files = get_files(paciente["id"])
+    def prefetch_thumbnails(files):
+        nonlocal thumbs
+        if thumbs is None:
+            thumbs = ThumbnailLoader(root, apply_thumbnail, THUMB_WORKERS)
+        for _, tipo, url in files:
+            if is_image(tipo):
+                thumbs.request(url, priority=1)
 
-            if not files:
-                empty_frame = tk.Frame(content, bg=CARD)
+    def resume_thumbnails():
+        # Coming back to the files tab: visible rows first, then the rest
+        vlist = views["partes"][0].vlist if "partes" in views else None
+        state = session_cache.get("partes")
+        if thumbs is None or vlist is None or state is None:
+            return
+        for _, (_, tipo, url) in vlist.bound_rows():
+            if is_image(tipo):
+                thumbs.request(url, priority=0)
+        prefetch_thumbnails(state["files"])
+
+    def build_files_view(view):
+        tk.Label(view, text="📁 Archivos Médicos",
+                 fg=TEXT, bg=CARD, font=("Segoe UI", 26, "bold")).pack(anchor="w", pady=(0, 20), padx=10)
+
+        files_frame = tk.Frame(view, bg=CARD)
+        files_frame.pack(fill="both", expand=True)
+
+        # Skeleton cards until the first page comes back
+        for _ in range(3):
+            f = tk.Frame(files_frame, bg=BG2)
+            f.pack(fill="x", pady=10, padx=10)
+            skeleton_bar(f, 12).pack(anchor="w", padx=20, pady=(15, 4))
+            skeleton_bar(f, 40).pack(anchor="w", padx=20, pady=(0, 15))
+
+        vlist = None
+
+        def fit_to_page(e=None):
+            # The list scrolls on its own, so size it to the visible page
+            if vlist is not None and vlist.winfo_exists():
+                vlist.configure(width=max(400, canvas.winfo_width() - 20),
+                                height=max(300, canvas.winfo_height() - 160))
+        canvas.bind("<Configure>", lambda e: scheduler.request(fit_to_page), add="+")
+
+        def fill_files(state):
+            nonlocal vlist
+            if vlist is not None and vlist.winfo_exists():
+                if state["files"]:
+                    if state["files"] != vlist.items:
+                        prefetch_thumbnails(state["files"])
+                        vlist.update_items(state["files"])
+                    return
+                vlist = view.vlist = None
+
+            for w in files_frame.winfo_children():
+                w.destroy()
+
+            if not state["files"]:
+                empty_frame = tk.Frame(files_frame, bg=CARD)
                 empty_frame.pack(fill="both", expand=True, pady=50)
                 tk.Label(empty_frame, text="📭", font=("Segoe UI", 60), 
                         bg=CARD, fg=MUTED).pack()
                 tk.Label(empty_frame, text="No hay archivos asociados.",
                          fg=MUTED, bg=CARD, font=("Segoe UI", 16)
                          ).pack(pady=10)
-            else:
-                for name, tipo, url in files:
-                    f = tk.Frame(content, bg=BG2, relief="flat")
-                    f.pack(fill="x", pady=10, padx=10)
-
-                    file_info = tk.Frame(f, bg=BG2)
-                    file_info.pack(side="left", fill="x", expand=True, padx=20, pady=15)
-                    
-                    tk.Label(file_info, text=f"📄 {tipo}", fg=PRIMARY, bg=BG2,
-                             font=("Segoe UI", 12, "bold")).pack(anchor="w")
-                    tk.Label(file_info, text=name, fg=TEXT, bg=BG2,
-                             font=("Segoe UI", 13)).pack(anchor="w", pady=2)
-
-                    tk.Button(f, text="Ver archivo", bg=PRIMARY, fg="black",
-                              command=lambda u=url, t=tipo: open_preview(u, t),
-                              padx=20, pady=10, font=("Segoe UI", 11, "bold"),
-                              relief="flat", cursor="hand2",
-                              activebackground="#3dd5f3"
-                              ).pack(side="right", padx=20, pady=15)
-
-    draw()
-    
-    # Open avatar after successful login using subprocess
-    def open_avatar_after_login():
-        """Open avatar in webview after login using subprocess"""
-        try:
-            import subprocess
-            import sys
-            import os
-            
-            # Get path to avatar_window.py script
-            script_dir = os.path.dirname(os.path.abspath(__file__))
-            avatar_script = os.path.join(script_dir, "avatar_window.py")
-            
-            # Check if avatar_window.py exists, if not create it
-            if not os.path.exists(avatar_script):
-                # Create the avatar script
-                avatar_script_content = f'''#!/usr/bin/env python
-# -*- coding: utf-8 -*-
-"""Separate script to run avatar in webview window"""
-import webview
-import sys
+                return
 
-AVATAR_URL = "{AVATAR_URL}"
+            prefetch_thumbnails(state["files"])
+            vlist = view.vlist = VirtualList(files_frame, FILE_ROW_HEIGHT, make_file_row,
+                                             bind_file_row, on_near_end=load_more_files, bg=CARD)
+            vlist.pack(fill="x")
+            vlist.pack_propagate(False)
+            fit_to_page()
+            vlist.set_items(state["files"])
 
-if __name__ == "__main__":
-    try:
-        # Get position from command line arguments if provided
-        x = int(sys.argv[1]) if len(sys.argv) > 1 else None
-        y = int(sys.argv[2]) if len(sys.argv) > 2 else None
-        width = int(sys.argv[3]) if len(sys.argv) > 3 else 600
-        height = int(sys.argv[4]) if len(sys.argv) > 4 else 650
-        
-        window_config = {{
-            "title": "Avatar Medico - Asistente Virtual",
-            "url": AVATAR_URL,
-            "width": width,
-            "height": height,
-            "background_color": "#000000",
-            "resizable": True,
-            "min_size": (600, 600)
-        }}
-        
-        if x is not None and y is not None:
-            window_config["x"] = x
-            window_config["y"] = y
-        
-        webview.create_window(**window_config)
-        webview.start(gui="edgechromium", debug=False)
-    except Exception as e:
-        print(f"Error: {{e}}")
-        import traceback
-        traceback.print_exc()
-        sys.exit(1)
-'''
-                with open(avatar_script, 'w', encoding='utf-8') as f:
-                    f.write(avatar_script_content)
-            
-            # Get window position
-            root.update_idletasks()
-            main_x = root.winfo_x()
-            main_y = root.winfo_y()
-            main_width = root.winfo_width()
-            
-            # Position window to the right of main window
-            window_width = 600
-            window_height = 650
-            x_position = main_x + main_width + 10
-            y_position = main_y
-            
-            # Run avatar script in separate process (hide console window on Windows)
-            if sys.platform == 'win32':
-                # Use CREATE_NO_WINDOW to hide the console
-                subprocess.Popen(
-                    [sys.executable, avatar_script, str(x_position), str(y_position), 
-                     str(window_width), str(window_height)],
-                    creationflags=subprocess.CREATE_NO_WINDOW,
-                    stdout=subprocess.DEVNULL,
-                    stderr=subprocess.DEVNULL
-                )
-            else:
-                subprocess.Popen(
-                    [sys.executable, avatar_script, str(x_position), str(y_position), 
-                     str(window_width), str(window_height)],
-                    stdout=subprocess.DEVNULL,
-                    stderr=subprocess.DEVNULL
-                )
-        except Exception as e:
-            print(f"Error opening avatar: {e}")
-            import traceback
-            traceback.print_exc()
+        def append_files(files):
+            if vlist is not None and vlist.winfo_exists():
+                prefetch_thumbnails(files)
+                vlist.extend(files)
+
+        view.vlist = None
+        view.append_files = append_files
+        return fill_files, lambda e: show_load_error(files_frame, e)
+
+    # Each tab is built once per session and then only shown/hidden.
+    # Its data lives in the session cache until the TTL runs out or the
+    # user presses "Actualizar".
+    session_cache = SessionCache(SESSION_CACHE_TTL)
+    builders = {"paciente": build_paciente_view, "partes": build_files_view}
+    def fetch_first_files_page():
+        # A reload (refresh, change notification) asks for as many rows as are
+        # already listed, so the list isn't cut back to one page under the user
+        vlist = views["partes"][0].vlist if "partes" in views else None
+        shown = len(vlist.items) if vlist is not None else 0
+        files, next_after = get_files_page(paciente["id"], limit=max(FILES_PAGE_SIZE, shown))
+        return {"files": files, "next_after": next_after}
+
+    fetchers = {
+        "paciente": lambda: get_general_info(paciente["id"]),
+        "partes": fetch_first_files_page,
+    }
+    views = {}      # tab -> (frame, fill, fail)
+    loading = set()
+    # Tabs painted from the local snapshot and not yet revalidated
+    snapshots = get_snapshots()
+    painted = set()
+    stale = set()
+
+    def from_snapshot(tab):
+        data = snapshots.get(paciente["id"], tab) if snapshots is not None else None
+        if data is not None and tab == "partes":
+            data["files"] = [tuple(f) for f in data["files"]]
+            if data["next_after"] is not None:
+                data["next_after"] = tuple(data["next_after"])
+        return data
+
+    def load_more_files():
+        # Keyset pagination: ask for the rows after the last key seen
+        state = session_cache.get("partes")
+        if state is None or state["next_after"] is None:
+            return
+        if "partes" in loading or "partes-page" in loading:
+            return
+
+        def done(page):
+            loading.discard("partes-page")
+            files, next_after = page
+            state["files"].extend(files)
+            state["next_after"] = next_after
+            with tracer.span("ui", "render partes page", rows=len(files)):
+                views["partes"][0].append_files(files)
+
+        def failed(e):
+            loading.discard("partes-page")
+            print(f"Could not load more files: {e}")
+
+        loading.add("partes-page")
+        loader.submit("partes-page", get_files_page, paciente["id"], state["next_after"],
+                      on_done=done, on_error=failed)
+
+    def load(tab, force=False):
+        if tab in loading and not force:
+            return
+        if not force and session_cache.is_fresh(tab):
+            return
+        _, fill, fail = views[tab]
+
+        if tab not in painted:
+            # Stale-while-revalidate: show the last known data right away
+            data = from_snapshot(tab)
+            if data is not None:
+                with tracer.span("ui", f"render {tab} snapshot"):
+                    fill(data)
+                stale.add(tab)
+            painted.add(tab)
+
+        def fetch():
+            data = fetchers[tab]()
+            if snapshots is not None:
+                try:
+                    snapshots.put(paciente["id"], tab, data)
+                except sqlite3.Error as e:
+                    print(f"Could not save snapshot: {e}")
+            return data
+
+        def done(data):
+            loading.discard(tab)
+            stale.discard(tab)
+            session_cache.put(tab, data)
+            with tracer.span("ui", f"render {tab}"):
+                fill(data)
+
+        def failed(e):
+            loading.discard(tab)
+            if tab in stale:
+                # Keep the snapshot on screen rather than an error
+                print(f"Could not refresh {tab}, showing saved data: {e}")
+                return
+            fail(e)
+
+        loader.cancel(tab)
+        # Pages of the old result set must not land on the new one
+        loader.cancel(tab + "-page")
+        loading.discard(tab + "-page")
+        loading.add(tab)
+        loader.submit(tab, fetch, on_done=done, on_error=failed)
+
+    @traced("ui")
+    def show_tab(tab):
+        for name, (frame, _, _) in views.items():
+            if name != tab:
+                frame.pack_forget()
+        if tab not in views:
+            frame = tk.Frame(content, bg=CARD)
+            views[tab] = (frame,) + builders[tab](frame)
+        views[tab][0].pack(fill="both", expand=True)
+        load(tab)
+
+    def refresh(tab):
+        session_cache.invalidate()
+        load(tab, force=True)
+
+    def on_db_change(tables):
+        # Pushed by the change listener: reload only what those tables feed
+        if None in tables:
+            parts = {"summary", "paciente", "partes"}
+        else:
+            parts = {part for table in tables for part in NOTIFY_TABS.get(table, ())}
+        for part in parts:
+            if part == "summary":
+                loader.submit("summary", get_patient_by_id, paciente["id"], on_done=fill_summary,
+                              on_error=lambda e: print(f"Could not reload patient: {e}"))
+                continue
+            session_cache.invalidate(part)
+            if part in views:
+                load(part, force=True)
+
+    listener = None
+    if DB_LISTEN:
+        listener = ChangeListener(root, on_db_change, patient_id=paciente["id"])
+        listener.start()
+
+    show_tab(active_tab.get())
+    
+    # Show the pre-warmed avatar to the right of the main window
+    def show_avatar():
+        if not AVATAR_ENABLED:
+            return
+        root.update_idletasks()
+        x_position = root.winfo_x() + root.winfo_width() + 10
+        y_position = root.winfo_y()
+        if not avatar.show(x_position, y_position, AVATAR_WIDTH, AVATAR_HEIGHT):
             # Fallback: open in browser
             webbrowser.open(AVATAR_URL)
-    
-    # Open avatar after a short delay to ensure dashboard is fully loaded
-    root.after(500, open_avatar_after_login)
+
+    # Wait a moment so the dashboard has its final geometry.
+    # The avatar is the patient's assistant; physicians don't get it.
+    if on_back is None:
+        root.after(100, show_avatar)
+
+
+# ============================================================
+#   PHYSICIAN ROSTER
+# ============================================================
+ROSTER_ROW_HEIGHT = 76
+
+
+@traced("ui")
+def show_roster(root, user, medico_id):
+    """Every patient of the logged-in physician, read a page at a time as the list scrolls."""
+
+    for w in root.winfo_children():
+        w.destroy()
+
+    root.configure(bg=BG1)
+
+    header = tk.Frame(root, bg=BG2, height=80)
+    header.pack(fill="x")
+    header.pack_propagate(False)
+
+    header_content = tk.Frame(header, bg=BG2)
+    header_content.pack(fill="both", expand=True, padx=30, pady=15)
+
+    tk.Label(header_content, text=f"Bienvenido, {user['username']}",
+             fg=TEXT, bg=BG2, font=("Segoe UI", 24, "bold")).pack(side="left")
+
+    loader = BackgroundLoader(root, max_workers=1)
+
+    def close_session():
+        loader.shutdown()
+
+    def logout():
+        close_session()
+        login_successful.clear()
+        show_login(root)
+
+    tk.Button(header_content, text="Cerrar Sesión",
+              bg=DANGER, fg="white", font=("Segoe UI", 11, "bold"),
+              padx=20, pady=8, command=logout, relief="flat",
+              cursor="hand2", activebackground="#ff3d5c").pack(side="right")
+
+    body = tk.Frame(root, bg=CARD)
+    body.pack(fill="both", expand=True, padx=20, pady=20)
+
+    title_frame = tk.Frame(body, bg=CARD)
+    title_frame.pack(fill="x", padx=15, pady=(20, 10))
+    tk.Label(title_frame, text="🩺 Mis Pacientes", fg=TEXT, bg=CARD,
+             font=("Segoe UI", 26, "bold")).pack(side="left")
+    status = tk.Label(title_frame, text="Cargando pacientes…", fg=MUTED, bg=CARD,
+                      font=("Segoe UI", 12))
+    status.pack(side="right")
+
+    def open_patient(item):
+        patient_id, name = item[:2]
+
+        def done(p):
+            if p is None:
+                messagebox.showerror("Error", "El paciente ya no existe.")
+                return
+            close_session()
+            show_dashboard(root, user, p, title=f"Paciente: {name}",
+                           on_back=lambda: show_roster(root, user, medico_id))
+
+        loader.submit("open", get_patient_by_id, patient_id, on_done=done,
+                      on_error=lambda e: messagebox.showerror("Error", db_error_message(e)))
+
+    def make_row(parent):
+        row = tk.Frame(parent, bg=CARD)
+        f = tk.Frame(row, bg=BG2)
+        f.pack(fill="both", expand=True, pady=(0, 8), padx=10)
+        info = tk.Frame(f, bg=BG2)
+        info.pack(side="left", fill="x", expand=True, padx=20, pady=10)
+        row.name_label = tk.Label(info, fg=TEXT, bg=BG2, font=("Segoe UI", 13, "bold"))
+        row.name_label.pack(anchor="w")
+        row.detail_label = tk.Label(info, fg=MUTED, bg=BG2, font=("Segoe UI", 11))
+        row.detail_label.pack(anchor="w")
+        row.button = tk.Button(f, text="Ver expediente", bg=PRIMARY, fg="black",
+                               padx=16, pady=6, font=("Segoe UI", 11, "bold"),
+                               relief="flat", cursor="hand2", activebackground="#3dd5f3")
+        row.button.pack(side="right", padx=20)
+        return row
+
+    def bind_row(row, item):
+        patient_id, name, sexo, born = item
+        row.name_label.config(text=name)
+        row.detail_label.config(text=f"Sexo: {sexo}   ·   Nacimiento: {born}   ·   Id {patient_id}")
+        row.button.config(command=lambda i=item: open_patient(i))
+
+    # Keyset pages fetched as the list nears its end, like the files tab
+    page = {"next_after": None, "loading": False, "more": True}
+
+    def load_more():
+        if page["loading"] or not page["more"]:
+            return
+
+        def done(result):
+            page["loading"] = False
+            patients, page["next_after"] = result
+            page["more"] = page["next_after"] is not None
+            with tracer.span("ui", "render roster batch", rows=len(patients)):
+                vlist.extend(patients)
+            if not vlist.items:
+                status.config(text="No tienes pacientes asignados.", fg=MUTED)
+            else:
+                status.config(text=f"{len(vlist.items)} pacientes" + ("…" if page["more"] else ""),
+                              fg=MUTED)
+
+        def failed(e):
+            page["loading"] = False
+            status.config(text="No se pudo cargar la lista completa.", fg=DANGER)
+            print(f"Could not load roster: {e}")
+
+        page["loading"] = True
+        loader.submit("roster", get_roster_page, medico_id, page["next_after"],
+                      on_done=done, on_error=failed)
+
+    vlist = VirtualList(body, ROSTER_ROW_HEIGHT, make_row, bind_row,
+                        on_near_end=load_more, bg=CARD)
+    vlist.pack(fill="both", expand=True, padx=5, pady=(0, 10))
+
+    root.wheel_canvas = vlist
+    if not getattr(root, "wheel_bound", False):
+        root.bind_all("<MouseWheel>", lambda e: _on_wheel(root, e))
+        root.wheel_bound = True
+
+    load_more()
 
 
 # ============================================================
@@ -645,28 +4061,69 @@ def show_login(root):
     e_pass.pack(padx=40, pady=(0, 30), ipady=10)
 
     # Login button
+    login_loader = BackgroundLoader(root, max_workers=1)
+    pending = [False]
+
+    def set_busy(busy):
+        pending[0] = busy
+        if busy:
+            login_btn.config(state="disabled", text="Verificando…", cursor="watch")
+            progress.pack(fill="x", padx=40, pady=(0, 20))
+            progress.start(12)
+        else:
+            progress.stop()
+            progress.pack_forget()
+            login_btn.config(state="normal", text="Iniciar Sesión", cursor="hand2")
+
     def login():
+        if pending[0]:
+            return
+
         username = e_user.get().strip()
         password = e_pass.get().strip()
         
         if not username or not password:
             messagebox.showwarning("Campos vacíos", "Por favor completa todos los campos.")
             return
-        
-        user, error = validate_user(username, password)
 
-        if error:
-            messagebox.showerror("Error de inicio de sesión", error)
-            return
+        def done(result):
+            user, paciente, error = result
 
-        paciente = get_patient_by_user(user["id"])
-        if not paciente:
-            messagebox.showerror("Error", "Este usuario no es un paciente.")
-            return
+            if error:
+                set_busy(False)
+                messagebox.showerror("Error de inicio de sesión", error)
+                return
 
-        # Mark login as successful and show dashboard
-        login_successful.set()
-        show_dashboard(root, user, paciente)
+            if not paciente:
+                # Not a patient: physicians get their roster
+                login_loader.submit("login", get_physician_id, user["id"],
+                                    on_done=lambda medico_id: physician(user, medico_id),
+                                    on_error=failed)
+                return
+
+            # Mark login as successful and show dashboard
+            set_busy(False)
+            login_loader.shutdown()
+            login_successful.set()
+            show_dashboard(root, user, paciente)
+
+        def physician(user, medico_id):
+            set_busy(False)
+            if medico_id is None:
+                messagebox.showerror("Error", "Este usuario no es un paciente ni un médico.")
+                return
+            login_loader.shutdown()
+            login_successful.set()
+            show_roster(root, user, medico_id)
+
+        def failed(e):
+            set_busy(False)
+            messagebox.showerror("Error de inicio de sesión", f"Error al validar usuario: {str(e)}")
+
+        # DB round trip + bcrypt run on the worker; the window stays responsive
+        set_busy(True)
+        login_loader.submit("login", authenticate, username, password,
+                            on_done=done, on_error=failed)
 
     login_btn = tk.Button(login_frame, text="Iniciar Sesión", bg=PRIMARY, fg="black",
                          font=("Segoe UI", 14, "bold"), pady=12, width=25,
@@ -674,6 +4131,8 @@ def show_login(root):
                          activebackground="#3dd5f3", activeforeground="black")
     login_btn.pack(pady=(0, 20))
 
+    progress = ttk.Progressbar(login_frame, mode="indeterminate")
+
     # Bind Enter key to login
     e_pass.bind("<Return>", lambda e: login())
     e_user.bind("<Return>", lambda e: e_pass.focus())
@@ -686,15 +4145,49 @@ def show_login(root):
 #   TKINTER THREAD + AVATAR MAIN
 # ============================================================
 def start_tk():
+    startup.mark("module imports")
     root = tk.Tk()
     root.title("Portal del Paciente")
     root.geometry("1500x900")
+    startup.mark("Tk root created")
+    root.bind_all("<F12>", lambda e: open_trace_overlay(root))
+    stall_detector = None
+    if STALL_DETECT:
+        stall_detector = StallDetector(root, STALL_THRESHOLD_MS, STALL_REPORT_EVERY)
+        stall_detector.start()
     show_login(root)
-    root.mainloop()
+    startup.mark("login screen built")
+    # Paint the login window before anything heavy happens
+    root.update()
+    startup.mark("login painted")
+
+    def interactive():
+        startup.mark("login interactive")
+        if STARTUP_REPORT:
+            print(startup.report())
+        threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+        # Pre-warm the hidden avatar window while the user types
+        if AVATAR_ENABLED:
+            avatar.start()
+    root.after_idle(interactive)
+
+    try:
+        root.mainloop()
+    finally:
+        if stall_detector is not None:
+            stall_detector.stop()
+        avatar.stop()
+        close_pool()
+        if _file_cache is not None:
+            _file_cache.flush()
+        if QUERY_STATS:
+            print(queries.report())
 
 
 # Start Tkinter in main thread (GUI should be in main thread)
 if __name__ == "__main__":
+    if "--export-summaries" in sys.argv:
+        sys.exit(summaries_main([a for a in sys.argv[1:] if a != "--export-summaries"]))
     try:
         start_tk()
     except Exception as e: